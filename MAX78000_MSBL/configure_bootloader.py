@@ -34,437 +34,140 @@
 ###############################################################################
 
 from __future__ import print_function
-import os
 import sys
-import serial
-import threading
-import logging
-import signal
 import time
 import argparse
-import atexit
-import re
-import struct
-import ctypes
-import zlib
-import time
-import ConfigParser
-from enum import Enum
-from copy import deepcopy
-from ctypes import *
-from threading import Timer, Thread, Event
+import json
+try:
+	import ConfigParser
+except ImportError:
+	import configparser as ConfigParser
+from threading import Thread
 from datetime import datetime
-from colorama import Fore, Back, Style, init
-from packaging import version
-
-VERSION = "0.2"
-platform_types = {1: 'MAX32660'}
-
-class Object(object):
-    pass
-
-bl_exit_mode = { 0 : 'Jump immediately',
-				1 : 'Wait for programmable delay',
-				2 : 'remain in bootloader until receive exit command'}
-
-bl_gpio_polarities = {  0 : 'active low',
-						1 : 'active high'}
-
-bl_entry_check = {	0 : 'Do not check EBL pin',
-					1 : 'Check EBL pin'}
-
-bl_config_en_dis = { 0 : 'disabled',
-					 1 : 'enabled'}
-
-bl_config_i2c_addr = {  0 : '0x58',
-						1 : '0x5A',
-						2 : '0x5C',
-						3 : '0xAA'}
-
-class EBL_MODE:
-	USE_TIMEOUT = 0
-	USE_GPIO = 1
-
-class MaximBootloaderConfigurator(object):
-	def __init__(self, port):
-		self.ser = serial.Serial()
-		self.ser.port = port
-		self.ser.baudrate = 115200
-		self.ser.timeout = 300
-		try:
-			self.ser.open()	 # open the serial port
-
-			if self.ser.isOpen():
-				 print(self.ser.name + ' is open...')
-		except (OSError, serial.SerialException):
-			print (Fore.RED + 'Cannot open serial port ' + port)
-			exit(-1)
-
-		self.quit_flag = False
+from colorama import Fore, init
+from host_link import parse_baudrates, replace_file, expand_ports
+from maxim_bootloader import BootloaderError, PortError, console_output, port_output
+from maxim_bootloader import MaximBootloaderConfigurator, bl_config_commands, read_profile
+from maxim_bootloader import normalize_config, config_differences
+
+VERSION = "0.3"
+
+def configure_port(port, args, ebl_mode, results):
+	start = time.time()
+	error = None
+	bl = None
+	try:
+		bl = MaximBootloaderConfigurator(port, args.baudrates, args.batch, port_output(port))
+		bl.set_host_mcu(ebl_mode, args.delay_factor, args.comm_interface)
+		bl.bootloader_configure(args.reset, args.config_file)
+	except Exception as e:
+		error = str(e)
+		console_output(port + ': ' + error, Fore.RED)
+	finally:
+		if bl is not None:
+			bl.close()
+	results[port] = {'port': port, 'ok': error is None, 'error': error,
+					'seconds': round(time.time() - start, 2)}
+
+def audit_port(port, args, ebl_mode, profile, results):
+	start = time.time()
+	entry = {'port': port, 'ok': False, 'error': None}
+	bl = None
+	try:
+		bl = MaximBootloaderConfigurator(port, args.baudrates)
+		bl.set_host_mcu(ebl_mode, args.delay_factor, args.comm_interface)
+		device_info, bl_config = bl.audit()
+		entry['device_info'] = device_info
+		entry['bl_config'] = normalize_config(bl_config, bl.bl_version)
+		if profile is not None:
+			entry['differences'] = [{'setting': key, 'expected': expected, 'actual': actual}
+									for key, expected, actual in config_differences(profile, entry['bl_config'], bl.bl_version)]
+		entry['ok'] = True
+	except Exception as e:
+		entry['error'] = str(e)
+	finally:
+		if bl is not None:
+			bl.close()
+	entry['seconds'] = round(time.time() - start, 2)
+	results[port] = entry
+
+def run_on_ports(target, ports, *args):
+	"""Runs target(port, *args) for every port in its own thread, returns
+	the {port: result} they filled in and the elapsed time."""
+	results = {}
+	threads = []
+	start = time.time()
+	for port in ports:
+		thread = Thread(target=target, args=(port,) + args + (results,))
+		thread.daemon = True
+		thread.start()
+		threads.append(thread)
+	for thread in threads:
+		# join with a timeout so Ctrl + C still reaches the main thread
+		while thread.is_alive():
+			thread.join(0.5)
+	return results, time.time() - start
+
+def print_audit(report, ports):
+	print(Fore.CYAN + '\n>>> Audit <<<')
+	for port in ports:
+		entry = report['ports'][port]
+		if not entry['ok']:
+			print(Fore.RED + port + ': ERROR ' + str(entry['error']))
+			continue
+		info = entry['device_info']
+		board = str(info.get('platform', info.get('platform_type'))) + ' ' + str(info.get('hub_firm_ver'))
+		differences = entry.get('differences')
+		if differences is None:
+			print(port + ': ' + board + '  ' + ', '.join(key + '=' + str(entry['bl_config'][key])
+						for key, _, _ in bl_config_commands))
+		elif differences:
+			print(Fore.RED + port + ': ' + board + '  DIFFERS: ' + ', '.join(
+						d['setting'] + ' is ' + str(d['actual']) + ', expected ' + str(d['expected'])
+						for d in differences))
+		else:
+			print(Fore.GREEN + port + ': ' + board + '  matches ' + report['profile'])
 
-	def key_press_to_continue(self):
+def fleet_audit(args, ports, ebl_mode):
+	"""Reads every port concurrently, returns True if all answered and match the profile."""
+	profile = None
+	if args.config_file is not None:
 		try:
-			input("Press enter to continue")
-		except SyntaxError:
-			pass
-		except KeyboardInterrupt:
-			print('Interrupted by Ctrl + C...')
-			self.quit()
-
-	def set_host_mcu(self, ebl_mode, delay_factor, comm_interface):
-
-		if comm_interface is not None and self.set_host_comm_interface(comm_interface) != 0:
-			print('Unable to change communication medium.')
-			return False
-
-		if self.disable_echo() != 0:
-			print('Unable to disable echo mode. Communication failed...')
-			return False
-
-		if not EBL_MODE.USE_TIMEOUT <= ebl_mode <= EBL_MODE.USE_GPIO:
-			print("Invalid parameter")
+			profile = read_profile(args.config_file)
+		except (IOError, ValueError, ConfigParser.Error) as e:
+			print(Fore.RED + 'Reading config file failed: ' + str(e))
 			return False
-
-		if self.set_host_ebl_mode(ebl_mode) != 0:
-			print('Unable to set EBL mode in host')
-			return False
-
-		if self.set_host_delay_factor(delay_factor) != 0:
-			print('Unable to set delay factor mode in host')
-			return False
-
-
-		return True
-
-
-	######### Bootloader Configure #########
-	def bootloader_configure(self, reset, config_file):
-		print('\nConfiguring bootloader')
-		config = ConfigParser.RawConfigParser()
-		if config_file!= None:
-			config.read(config_file)
-
-		if self.enter_bootloader_mode() != 0:
-			print('Entering bootloader mode failed')
-			return
-
-		self.bl_version = self.get_bl_version()
-		if self.bl_version is None:
-			print('Unable to read bootloader version')
-
-		# if self.get_device_info() != 0:
-			# print('Reading device info failed')
-
-		if config_file!= None:
-			var = config.getint('BootConfig', 'enter_bl_check')
-			if self.set_config_ebl_check(str(var)):
-				print('Enter BL check configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'ebl_pin')
-			if self.set_config_ebl_pin(str(var)):
-				print('EBL Pin configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'ebl_pol')
-			if self.set_config_ebl_polarity(str(var)):
-				print('EBL Pin Polarity configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'valid_mark_check')
-			if self.set_config_valid_check(str(var)):
-				print('Valid Mark Check configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'uart_enable')
-			if self.set_config_interface('uart', str(var)):
-				print('UART interface configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'i2c_enable')
-			if self.set_config_interface('i2c', str(var)):
-				print('I2C interface configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'spi_enable')
-			if self.set_config_interface('spi', str(var)):
-				print('SPI interface configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'i2c_addr')
-			if self.set_config_i2c_addr(str(var)):
-				print('I2C Slave Addr configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'crc_check')
-			if self.set_config_crc_check(str(var)):
-				print('CRC Check configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'swd_lock')
-			if self.set_config_swd_lock(str(var)):
-				print('SWD Lock configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'ebl_timeout')
-			if self.set_config_bl_timeout(str(var)):
-				print('BL Timeout configuration failed')
-				return
-
-			var = config.getint('BootConfig', 'exit_bl_mode')
-			if self.set_exit_bl_to_mode(str(var)):
-				print('Exit BL Timeout Mode configuration failed')
-				return
-
-			if self.save_bl_config():
-				print('Bootloader Config save failed')
-				return
-
-		if self.get_config_bl():
-			print('BL config received')
-			return
-
-		self.exit_from_bootloader(0)
-
-
-	def set_host_comm_interface(self, comm):
-		print(Fore.GREEN + '\nBootloader communication interface as ' + comm)
-		ret = self.send_str_cmd('set_cfg comm ' + str(comm) + '\n')
-		#print('Command: set_cfg comm ' + str(comm) + '\n')
-		if ret[0] == 0:
-			print('Set comm interface to ' + str(comm))
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_ebl_check(self, ebl):
-		ret = self.send_str_cmd('set_cfg bl enter_mode ' + str(ebl) + '\n')
-		#print('Command: set_cfg bl enter_mode ' + str(ebl) + '\n')
-		if ret[0] == 0:
-			print(Fore.GREEN + '\tenter_bl_check ' + bl_config_en_dis[int(ebl)])
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_ebl_polarity(self, pol):
-		ret = self.send_str_cmd('set_cfg bl enter_pol ' + str(pol) + '\n')
-		#print('Command: set_cfg bl enter_pol ' + str(pol) + '\n')
-		if ret[0] == 0:
-			print(Fore.GREEN + '\tebl_polarity is ' + bl_gpio_polarities[int(pol)])
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_ebl_pin(self, pin):
-		ret = self.send_str_cmd('set_cfg bl enter_pin ' + '0 ' + str(pin) + '\n')
-		#print('Command: set_cfg bl enter_pin ' + '0.' + str(pin) + '\n')
-		if ret[0] == 0:
-			print(Fore.GREEN + '\tebl_pin ' + pin)
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_valid_check(self, validMark):
-		ret = self.send_str_cmd('set_cfg bl valid ' + str(validMark) + '\n')
-		#print('Command: set_cfg valid ' + str(validMark) + '\n')
-		if ret[0] == 0:
-			if(validMark):
-				print(Fore.GREEN + '\tvalid_mark_check ' + bl_config_en_dis[int(validMark)])
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_interface(self, interface, comm):
-
-		ret = self.send_str_cmd('set_cfg bl ' + interface + ' ' + str(comm) + '\n')
-		#print('Command: set_cfg bl ' + interface + str(comm) + '\n')
-		if ret[0] == 0:
-			print(Fore.GREEN  + '\t' + interface.lower() + '_enable: ' + str(comm))
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_i2c_addr(self, i2c_addr):
-		ret = self.send_str_cmd('set_cfg bl addr_i2c ' + str(i2c_addr) + '\n')
-		#print('Command: set_cfg bl addr_i2c ' + str(i2c_addr) + '\n')
-		if ret[0] == 0:
-			if (version.parse(self.bl_version) < version.parse('3.4.2')):
-				i2c_addr = bl_config_i2c_addr[int(i2c_addr)]
-			print(Fore.GREEN + '\ti2c_addr: ' + str(i2c_addr))
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_crc_check(self, crc):
-		ret = self.send_str_cmd('set_cfg bl crc ' + str(crc) + '\n')
-		#print('Command: set_cfg crc ' + str(crc) + '\n')
-		if ret[0] == 0:
-			print(Fore.GREEN + '\tcrc_check ' + bl_config_en_dis[int(crc)])
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_swd_lock(self, lock_mode):
-		ret = self.send_str_cmd('set_cfg bl swd_lock ' + str(lock_mode) + '\n')
-		#print('Command: set_cfg swd_lock ' + str(crc) + '\n')
-		if ret[0] == 0:
-			print(Fore.GREEN + '\tswd_lock ' + bl_config_en_dis[int(lock_mode)])
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_exit_bl_to_mode(self, mode):
-		ret = self.send_str_cmd('set_cfg bl exit_mode ' + str(mode) + '\n')
-		#print('Command: set_cfg bl exit_mode ' + str(mode) + '\n')
-		if ret[0] == 0:
-			print(Fore.GREEN + '\texit_bl_mode: ' + bl_exit_mode[int(mode)])
-		time.sleep(0.6)
-		return ret[0]
-
-	def set_config_bl_timeout(self, timeout):
-		ret = self.send_str_cmd('set_cfg bl exit_to ' + str(timeout) + '\n')
-		#print('Command: sset_cfg bl exit_to ' + str(timeout) + '\n')
-		if ret[0] == 0:
-			print(Fore.GREEN + '\tebl_timeout: ' + timeout)
-		time.sleep(0.6);
-		return ret[0]
-
-	def save_bl_config(self):
-		#print(Fore.GREEN + '\nSave Bootloader Config')
-		ret = self.send_str_cmd('set_cfg bl save ' + '\n')
-		if ret[0] == 0:
-			print('Bootloader Config saved')
-		time.sleep(0.6);
-		return ret[0]
-
-	def get_bl_version(self):
-		ret = self.send_str_cmd('get_device_info\n')
-		version = None
-		if ret[0] == 0:
-			version = str(ret[1]['hub_firm_ver'])
-		return version
-
-	def get_config_bl(self):
-		ret = self.send_str_cmd('get_cfg bl\n')
-		if ret[0] == 0:
-			i2c_addr = int(ret[1]['i2c_addr'])
-			if (version.parse(self.bl_version) < version.parse('3.4.2')):
-				i2c_addr = bl_config_i2c_addr[i2c_addr]
-			print(Fore.GREEN + '\tBL config received ')
-			print(Fore.GREEN + '\tenter_bl_check ' + bl_config_en_dis[int(ret[1]['enter_bl_check'])])
-			print(Fore.GREEN + '\tebl_pin: ' + str(ret[1]['ebl_pin']))
-			print(Fore.GREEN + '\tebl_polarity is ' + bl_gpio_polarities[int(ret[1]['ebl_polarity'])])
-			print(Fore.GREEN + '\tvalid_mark_check: ' + bl_config_en_dis[int(ret[1]['valid_mark_check'])])
-			print(Fore.GREEN + '\tuart_enable: ' + str(ret[1]['uart_enable']))
-			print(Fore.GREEN + '\ti2c_enable: ' + str(ret[1]['i2c_enable']))
-			print(Fore.GREEN + '\tspi_enable: ' + str(ret[1]['spi_enable']))
-			print(Fore.GREEN + '\ti2c_addr: ' + str(i2c_addr))
-			print(Fore.GREEN + '\tcrc_check ' + bl_config_en_dis[int(ret[1]['crc_check'])])
-			print(Fore.GREEN + '\tswd_lock ' + bl_config_en_dis[int(ret[1]['swd_lock'])])
-			print(Fore.GREEN + '\tebl_timeout: ' + str(ret[1]['ebl_timeout']))
-			print(Fore.GREEN + '\texit_bl_mode: ' + bl_exit_mode[int(ret[1]['exit_bl_mode'])])
-		time.sleep(0.6);
-		return ret[0]
-
-	def set_host_ebl_mode(self, ebl_mode):
-		print(Fore.GREEN + '\nSet timeout mode to enter bootloader')
-		ret = self.send_str_cmd('set_cfg host ebl ' + str(ebl_mode) + '\n')
-		print('Command: set_cfg host ebl ' + str(ebl_mode) + '\n')
-		if ret[0] == 0:
-			print('Set ebl_mode to ' + str(ebl_mode))
-		return ret[0]
-
-	def set_host_delay_factor(self, delay_factor):
-		print(Fore.GREEN + '\nSet delay factor in host')
-		ret = self.send_str_cmd('set_cfg host cdf ' + str(delay_factor) + '\n')
-		if ret[0] == 0:
-			print('Set bl comm delay factor to ' + str(delay_factor))
-		return ret[0]
-
-	def disable_echo(self):
-		while True:
-			ret = self.send_str_cmd('silent_mode 1\n')
-			if ret[0] == 0:
-				print('In silent mode. ret: ' + str(ret[0]))
-				break
-			elif ret[0] == -1:
-				break
-			else:
-				print("Failed... ret: " + str(ret[0]) + " RETRY...")
-		return ret[0]
-
-
-		for i in range(10):
-			out = self.ser.readline()
-			length = len(out)
-			if (length > 2):
-				break;
-
-		if (length < 2):
-			print('send_str_cmd failed. cmd: ' + cmd + ' len: ' + str(length))
-			return -1;
-
-	def parse_response(self, cmd):
-		retry = 0
-		while True:
-			try:
-				out = self.ser.readline()
-			except:
-				return [-1, {}]
-
-			length = len(out)
-			if (length < 2):
-				print('TRY AGAIN... send_str_cmd failed. cmd: ' + cmd + ' len: ' + str(length))
-				continue
-
-			arr=out.split(' ')
-			values = {}
-			num_keys = len(arr)
-			for i in range(1, num_keys):
-				key_pair = arr[i].split('=')
-				if len(key_pair) == 2:
-					values[key_pair[0]] = key_pair[1]
-				else:
-					values[key_pair[0]] = ''
-
-			retry = retry + 1
-			if 'err' in values:
-				break
-			else:
-				continue
-
-		return [int(values['err']), values];
-
-
-	def send_str_cmd(self, cmd):
-		length = 0;
-		self.ser.write(cmd.encode())
-		return self.parse_response(cmd.encode())
-
-	def enter_bootloader_mode(self):
-		ret = self.send_str_cmd('bootldr\n')
-		if ret[0] != 0:
-			print('Unable to enter bootloader mode... err: ' + str(ret[0]))
-		return ret[0]
-
-	def get_device_info(self):
-		ret = self.send_str_cmd('get_device_info\n')
-		if ret[0] == 0:
-			for key, value in ret[1].items():
-			    print(key, value)
+	results, elapsed = run_on_ports(audit_port, ports, args, ebl_mode, profile)
+	report = {'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'profile': args.config_file,
+				'ports': dict((port, results.get(port, {'port': port, 'ok': False, 'error': 'no result'}))
+							for port in ports)}
+	print_audit(report, ports)
+	failed = [port for port in ports if not report['ports'][port]['ok']]
+	differ = [port for port in ports if report['ports'][port].get('differences')]
+	print('Boards: ' + str(len(ports)) + '  errors: ' + str(len(failed)) + '  differ: ' + str(len(differ))
+			+ '  Total time: ' + '{:.1f}'.format(elapsed) + ' sec')
+	if args.report is not None:
+		tmp_name = args.report + '.tmp'
+		with open(tmp_name, 'w') as f:
+			json.dump(report, f, indent=1, sort_keys=True)
+		replace_file(tmp_name, args.report)
+		print('Report saved to ' + args.report)
+	return not failed and not differ
+
+def fleet_configure(args, ports, ebl_mode):
+	results, elapsed = run_on_ports(configure_port, ports, args, ebl_mode)
+	passed = 0
+	print(Fore.CYAN + '\n>>> Results <<<')
+	for port in ports:
+		entry = results.get(port, {'ok': False, 'seconds': 0.0})
+		if entry['ok']:
+			passed = passed + 1
+			print(Fore.GREEN + port + ': PASS in ' + '{:.1f}'.format(entry['seconds']) + ' sec')
 		else:
-			print('Device Info err: ' + str(ret[0]))
-		return ret[0]
-
-	def exit_from_bootloader(self, num_pages):
-		time.sleep(0.03*num_pages);
-		print(Fore.GREEN + '\nJump to main application')
-		ret = self.send_str_cmd('exit\n')
-		if ret[0] == 0:
-			print('Jumping to main application. ret: ' + str(ret[0]))
-		return ret[0]
-
-	def print_as_hex(self, label, arr):
-		print(label + ' : ' + ' '.join(format(i, '02x') for i in arr))
-
-	def quit(self):
-		self.quit_flag = True
-		self.close()
-
-	def close(self):
-		print("Closing")
-		self.ser.close()
+			print(Fore.RED + port + ': FAIL after ' + '{:.1f}'.format(entry['seconds']) + ' sec')
+	print('Passed: ' + str(passed) + '/' + str(len(ports))
+			+ '  Total time: ' + '{:.1f}'.format(elapsed) + ' sec')
+	return passed == len(ports)
 
 def main():
 	parser = argparse.ArgumentParser()
@@ -474,7 +177,9 @@ def main():
                     help=("Serial port name in Windows and device file path in Linux."
 							"For example:"
 							"	/dev/ttyACM0 in linux"
-							"	COM1 in Windows"))
+							"	COM1 in Windows"
+							"A comma separated list or a glob such as /dev/ttyACM* configures or audits "
+							"all ports in parallel."))
 
 	parser.add_argument("-e", "--ebl_mode", action='store_true',
                     help="This parameter sets host to use GPIO to put device into bootloader mode. "
@@ -497,6 +202,23 @@ def main():
 					"Default is i2c unless this parameter is specified.",
 					default='i2c')
 
+	parser.add_argument("-b", "--baudrates", type=parse_baudrates,
+					metavar="921600,115200",
+					help="Comma separated baud rates to probe, the fastest one the host answers at is used "
+					"and remembered for the port. Default is 921600,460800,230400,115200")
+
+	parser.add_argument("--batch", action='store_true',
+					help="Send all settings of the config file back to back, then save and verify once. "
+					"Default is one setting per round trip.")
+
+	parser.add_argument("--audit", action='store_true',
+					help="Only read get_device_info and get_cfg bl from every port concurrently and print "
+					"one summary. With -f, boards whose settings differ from the config file are flagged. "
+					"Nothing is written to the boards.")
+
+	parser.add_argument("--report", type=str, metavar="FILE",
+					help="Save the --audit results of all ports to FILE as json.")
+
 	parser.add_argument('--version', action='version', version='%(prog)s ' + VERSION)
 	args = parser.parse_args()
 	init(autoreset=True)
@@ -508,18 +230,40 @@ def main():
 	print("Port: ", args.port)
 	print("Comm Interface: ", args.comm_interface)
 
-	bl = MaximBootloaderConfigurator(args.port)
+	ports = expand_ports(args.port)
+	if len(ports) == 0:
+		print(Fore.RED + 'No serial port matches ' + args.port)
+		sys.exit(-1)
+	if args.audit or len(ports) > 1:
+		try:
+			if args.audit:
+				ok = fleet_audit(args, ports, ebl_mode)
+			else:
+				ok = fleet_configure(args, ports, ebl_mode)
+		except KeyboardInterrupt:
+			sys.exit(0)
+		sys.exit(0 if ok else -1)
+
+	try:
+		bl = MaximBootloaderConfigurator(ports[0], args.baudrates, args.batch, console_output)
+	except PortError as e:
+		print(Fore.RED + str(e))
+		sys.exit(-1)
 	print('### Press double Ctrl + C to stop\t');
 	try:
 
-		if bl.set_host_mcu(ebl_mode, args.delay_factor, args.comm_interface) == False:
-			raise Exception('Unable to set host')
+		bl.set_host_mcu(ebl_mode, args.delay_factor, args.comm_interface)
 
 		bl.bootloader_configure(args.reset, args.config_file)
 
+	except BootloaderError as e:
+		print(Fore.RED + str(e))
+		bl.close()
+		sys.exit(-1)
 	except KeyboardInterrupt:
 		bl.quit();
 		sys.exit(0);
+	bl.close()
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,266 @@
+#!/usr/bin/python
+
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+
+# Builds .msbl images from application .bin files, the same format that
+# msblGenWin32.exe writes, on any host with Python.
+
+from __future__ import print_function
+import os
+import sys
+import time
+import zlib
+import struct
+import ctypes
+import argparse
+import binascii
+import multiprocessing
+from colorama import Fore, init
+from host_link import replace_file
+from ctypes import sizeof
+from maxim_bootloader import MsblHeader, DEFAULT_PAGE_SIZE, PAGE_LENGTH, buffer_view, read_key_block
+try:
+	from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+	from cryptography.hazmat.backends import default_backend
+except ImportError:
+	Cipher = None
+
+VERSION = "0.1"
+
+# AES-CCM as used by the bootloader: 11 byte nonce, 16 byte tag, and the
+# pages of the image as one message, so page i starts at counter 1 + i*513.
+NONCE_SIZE = 11
+TAG_SIZE = 16
+CCM_L = 15 - NONCE_SIZE
+BLOCKS_PER_PAGE = PAGE_LENGTH // 16
+# pages encrypted by one pool task, enough to outweigh the pickling
+PAGES_PER_JOB = 16
+# smallest image encrypted by a pool by default, below it starting the
+# processes costs more than the AES they take over
+PARALLEL_MIN_PAGES = 1024
+
+def read_key_file(key_file):
+	"""Returns the AES key and AAD of a generate_key_v3.sh key file as bytes."""
+	with open(key_file, 'r') as keyfile:
+		key = binascii.unhexlify(read_key_block(keyfile, 'aes_key_start\n'))
+		aad = binascii.unhexlify(read_key_block(keyfile, 'aes_aad_start\n'))
+	if len(key) not in (16, 24, 32):
+		raise ValueError('Wrong Key Length')
+	if len(aad) > 32:
+		raise ValueError('Wrong AAD Length')
+	return key, aad
+
+def seal_page(data):
+	"""Pads page data to a page and appends its CRC32 and the padding."""
+	page = bytearray(PAGE_LENGTH)
+	page[:len(data)] = data
+	crc = zlib.crc32(buffer_view(page, 0, DEFAULT_PAGE_SIZE)) & 0xFFFFFFFF
+	struct.pack_into('<I', page, DEFAULT_PAGE_SIZE, crc)
+	return page
+
+def aes(key, mode):
+	return Cipher(algorithms.AES(key), mode, backend=default_backend()).encryptor()
+
+def counter_block(nonce, counter):
+	return struct.pack('B', CCM_L - 1) + nonce + struct.pack('>I', counter)
+
+def encrypt_sealed(pages, first, key, nonce):
+	"""Encrypts sealed pages, the first of them page first of the image, as one
+	string. Every page has its own counter, so pages are encrypted
+	independently of each other."""
+	encrypted = []
+	for i, page in enumerate(pages):
+		ctr = aes(key, modes.CTR(counter_block(nonce, 1 + (first + i) * BLOCKS_PER_PAGE)))
+		encrypted.append(ctr.update(bytes(page)) + ctr.finalize())
+	return b''.join(encrypted)
+
+def read_sealed(f, count):
+	return [seal_page(f.read(DEFAULT_PAGE_SIZE)) for _ in range(count)]
+
+def encrypt_pages(job):
+	"""Pool task: reads, seals and encrypts count pages of the application from
+	first, returns only the encrypted pages."""
+	bin_file, first, count, key, nonce = job
+	with open(bin_file, 'rb') as f:
+		f.seek(first * DEFAULT_PAGE_SIZE)
+		return encrypt_sealed(read_sealed(f, count), first, key, nonce)
+
+class CcmMac(object):
+	"""CBC-MAC half of AES-CCM over a message fed in 16 byte multiples."""
+	def __init__(self, key, nonce, aad, length):
+		self.key = key
+		self.nonce = nonce
+		self.cbc = aes(key, modes.CBC(b'\0' * 16))
+		flags = (0x40 if aad else 0) | ((TAG_SIZE - 2) // 2) << 3 | (CCM_L - 1)
+		blocks = struct.pack('B', flags) + nonce + struct.pack('>I', length)
+		if aad:
+			encoded = struct.pack('>H', len(aad)) + aad
+			blocks += encoded + b'\0' * (-len(encoded) % 16)
+		self.update(blocks)
+
+	def update(self, data):
+		self.last = self.cbc.update(data)[-16:]
+
+	def tag(self):
+		s0 = aes(self.key, modes.CTR(counter_block(self.nonce, 0))).update(b'\0' * 16)
+		return bytes(bytearray(a ^ b for a, b in zip(bytearray(self.last), bytearray(s0))))
+
+def trailer_page(app_crc, size):
+	return bytes(seal_page(struct.pack('<II', app_crc, size)))
+
+def build_msbl(bin_file, msbl_file, key_file=None, target='MAX78000', nonce=None, processes=None):
+	"""Writes msbl_file from bin_file, encrypted with the key of key_file if given.
+
+	Pages are read, sealed and written in order here, where the CBC-MAC runs
+	over them. The CTR pass of an encrypted image of PARALLEL_MIN_PAGES pages
+	or more is spread over a pool of processes, one per CPU by default; 1
+	keeps it in this process. Returns the MsblHeader written.
+	"""
+	size = os.path.getsize(bin_file)
+	data_pages = (size + DEFAULT_PAGE_SIZE - 1) // DEFAULT_PAGE_SIZE
+	num_pages = data_pages + 1
+
+	header = MsblHeader()
+	header.magic = b'msbl'
+	header.formatVersion = 0
+	header.target = target.encode('ascii')
+	header.numPages = num_pages
+	header.pageSize = DEFAULT_PAGE_SIZE
+	header.crcSize = 4
+
+	key = None
+	aad = b''
+	if key_file is not None:
+		if Cipher is None:
+			raise RuntimeError('Encrypted images need the cryptography package: pip install cryptography')
+		key, aad = read_key_file(key_file)
+		if nonce is None:
+			nonce = os.urandom(NONCE_SIZE)
+		if len(nonce) != NONCE_SIZE:
+			raise ValueError('The nonce must be ' + str(NONCE_SIZE) + ' bytes')
+		mac = CcmMac(key, nonce, aad, num_pages * PAGE_LENGTH)
+		header.enc_type = ('AES-' + str(len(key) * 8)).encode('ascii')
+		header.nonce[:] = list(bytearray(nonce))
+
+	jobs = [(bin_file, first, min(PAGES_PER_JOB, data_pages - first), key, nonce)
+			for first in range(0, data_pages, PAGES_PER_JOB)]
+	if processes is None:
+		processes = multiprocessing.cpu_count() if data_pages >= PARALLEL_MIN_PAGES else 1
+	pool = None
+	if key is not None and processes > 1 and len(jobs) > 1:
+		pool = multiprocessing.Pool(min(processes, len(jobs)))
+
+	tmp_name = msbl_file + '.tmp'
+	try:
+		encrypted = pool.imap(encrypt_pages, jobs) if pool is not None else None
+		app_crc = 0
+		left = size
+		with open(bin_file, 'rb') as src, open(tmp_name, 'w+b') as f:
+			# the header is written last, once the tag is known
+			f.write(b'\0' * sizeof(header))
+			for _, first, count, _, _ in jobs:
+				pages = read_sealed(src, count)
+				for page in pages:
+					app_crc = zlib.crc32(buffer_view(page, 0, min(left, DEFAULT_PAGE_SIZE)), app_crc)
+					left = left - DEFAULT_PAGE_SIZE
+					if key is not None:
+						mac.update(bytes(page))
+				if key is None:
+					f.write(b''.join(bytes(page) for page in pages))
+				elif encrypted is not None:
+					f.write(next(encrypted))
+				else:
+					f.write(encrypt_sealed(pages, first, key, nonce))
+
+			trailer = trailer_page(app_crc & 0xFFFFFFFF, size)
+			if key is not None:
+				mac.update(trailer)
+				trailer = encrypt_sealed([trailer], data_pages, key, nonce)
+				header.auth[:] = list(bytearray(mac.tag()))
+			f.write(trailer)
+
+			f.seek(0)
+			f.write(ctypes.string_at(ctypes.addressof(header), ctypes.sizeof(header)))
+			f.flush()
+			f.seek(0)
+			crc = 0
+			for chunk in iter(lambda: f.read(1 << 20), b''):
+				crc = zlib.crc32(chunk, crc)
+			f.write(struct.pack('<I', crc & 0xFFFFFFFF))
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	replace_file(tmp_name, msbl_file)
+	return header
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("-f", "--input_file", type=str, required=True,
+					help="Application binary (.bin) to convert")
+	parser.add_argument("-k", "--key_file", type=str,
+					help="Key file from generate_key_v3.sh. Without it the pages are not encrypted.")
+	parser.add_argument("-o", "--output_file", type=str,
+					help="Output .msbl file. Default is the input file name with .msbl extension.")
+	parser.add_argument("-t", "--target", type=str, default="MAX78000",
+					help="Target name in the msbl header. Default is MAX78000")
+	parser.add_argument("-j", "--jobs", type=int, metavar="N",
+					help="Processes encrypting pages in parallel. Default is one per CPU for encrypted "
+					"images of " + str(PARALLEL_MIN_PAGES) + " pages or more, otherwise 1.")
+	parser.add_argument("--nonce", type=str, metavar="HEX",
+					help="11 byte nonce as hex, for reproducible builds. Default is random. "
+					"Never reuse a nonce with the same key for a different image.")
+	parser.add_argument('--version', action='version', version='%(prog)s ' + VERSION)
+	args = parser.parse_args()
+	init(autoreset=True)
+
+	if args.output_file is None:
+		args.output_file = os.path.splitext(args.input_file)[0] + '.msbl'
+	nonce = None
+	start = time.time()
+	try:
+		if args.nonce is not None:
+			nonce = binascii.unhexlify(args.nonce)
+		header = build_msbl(args.input_file, args.output_file, args.key_file, args.target,
+							nonce, args.jobs)
+	except (IOError, OSError, ValueError, TypeError, RuntimeError) as e:
+		print(Fore.RED + 'Building ' + args.output_file + ' failed: ' + str(e))
+		sys.exit(-1)
+	print('Wrote ' + args.output_file + '  numPages: ' + str(header.numPages)
+			+ '  enc_type: ' + (header.enc_type.decode('ascii') or 'none')
+			+ '  in ' + '{:.2f}'.format(time.time() - start) + ' sec')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,415 @@
+#!/usr/bin/python
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+
+# Microbenchmarks of the host side hot paths: opening and verifying images,
+# the CRC32 pass, reply parsing, page downloads and key file parsing. Images
+# are generated, replies come from a recorded session and pages go to a fake
+# port that acknowledges them, so no hardware is needed. Results are saved
+# as a baseline that later runs are compared against.
+
+from __future__ import print_function
+import os
+import sys
+import json
+import math
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+from colorama import Fore, init
+from host_link import ResponseReader, replace_file
+from maxim_bootloader import MaximBootloader, PAGE_LENGTH, open_image, parse_key_file
+from maxim_bootloader import read_key_manifest
+from generate_msbl import build_msbl
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+VERSION = "0.1"
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'host_benchmark_baseline.json')
+DEFAULT_SIZES = [32, 512, 4096]
+DEFAULT_THRESHOLD = 0.25
+# a slowdown must also be this many times the spread of the passes, so
+# run-to-run noise is not reported as a regression
+NOISE_FACTOR = 3
+# benchmarks whose run takes less than this are reported but never fail the
+# run, their timings swing with caches and the scheduler
+MICRO_TIME = 0.001
+SAMPLE_KEY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'max78000_sample_key.txt')
+
+# replies of the host to a single target flash of a 5 page image, recorded
+# from host_emulator.py
+RECORDED_SESSION = [
+	b'silent_mode err=0',
+	b'set_cfg err=0',
+	b'set_cfg err=0',
+	b'bootldr err=0',
+	b'image_on_ram err=0',
+	b'get_device_info platform_type=5 hub_firm_ver=3.4.4 err=0',
+	b'page_size value=8192 err=0',
+	b'get_usn value=00112233445566778899AABBCCDDEEFF0011223344556677 err=0',
+	b'num_pages err=0',
+	b'set_iv err=0',
+	b'set_auth err=0',
+	b'erase err=0',
+	b'flash err=0',
+	b'flash page=1 err=0',
+	b'flash page=2 err=0',
+	b'flash page=3 err=0',
+	b'flash page=4 err=0',
+	b'flash page=5 err=0',
+	b'exit err=0',
+]
+# a USB CDC link hands replies over in packets of this size
+PACKET_SIZE = 64
+
+
+class ReplayPort(object):
+	"""Serial stand-in that hands out a recorded reply stream in packets."""
+	def __init__(self, data, packet_size=PACKET_SIZE):
+		self.data = data
+		self.pos = 0
+		self.packet_size = packet_size
+		self.timeout = 0
+		self.port = 'replay'
+
+	@property
+	def in_waiting(self):
+		return min(self.packet_size, len(self.data) - self.pos)
+
+	def read(self, size=1):
+		size = min(size, self.packet_size)
+		data = self.data[self.pos: self.pos + size]
+		self.pos = self.pos + len(data)
+		return data
+
+
+class AckPort(object):
+	"""Serial stand-in for a host that acknowledges every page at once."""
+	def __init__(self):
+		self.rx = bytearray()
+		self.received = 0
+		self.pages = 0
+		self.timeout = 0
+		self.port = 'ack'
+		self.name = 'ack'
+
+	@property
+	def in_waiting(self):
+		return len(self.rx)
+
+	def write(self, data):
+		self.received = self.received + len(data)
+		while self.received >= PAGE_LENGTH:
+			self.received = self.received - PAGE_LENGTH
+			self.pages = self.pages + 1
+			self.rx += b'flash page=' + str(self.pages).encode('ascii') + b' err=0\r\n'
+		return len(data)
+
+	def read(self, size=1):
+		data = bytes(self.rx[:size])
+		del self.rx[:size]
+		return data
+
+	def close(self):
+		pass
+
+
+class Workspace(object):
+	"""Generated .bin and .msbl images and key files in a temporary directory."""
+	def __init__(self, sizes_kb):
+		self.directory = tempfile.mkdtemp(prefix='host_benchmark_')
+		self.images = {}
+		for size_kb in sizes_kb:
+			bin_file = os.path.join(self.directory, 'app_' + str(size_kb) + 'k.bin')
+			with open(bin_file, 'wb') as f:
+				f.write(os.urandom(size_kb << 10))
+			msbl_file = os.path.splitext(bin_file)[0] + '.msbl'
+			build_msbl(bin_file, msbl_file, processes=1)
+			self.images[size_kb] = (bin_file, msbl_file)
+		self.manifest = os.path.join(self.directory, 'manifest.txt')
+		shutil.copy(SAMPLE_KEY, os.path.join(self.directory, 'key.txt'))
+		with open(self.manifest, 'w') as f:
+			for i in range(1000):
+				f.write('%048X key.txt\n' % (i * 7919))
+			f.write('%048X-%048X key.txt\n' % (1 << 180, 1 << 190))
+
+	def close(self):
+		shutil.rmtree(self.directory, True)
+
+
+######### Benchmarks #########
+# Each returns (run, units, unit, close): run() does one pass over units of
+# work, close() releases what the setup opened, if anything.
+
+def bench_open_msbl(path):
+	def run():
+		open_image(path).close()
+	return run, os.path.getsize(path), 'B', None
+
+def bench_open_bin(path):
+	def run():
+		image = open_image(path)
+		for _ in image.iter_pages():
+			pass
+		image.close()
+	return run, os.path.getsize(path), 'B', None
+
+def bench_msbl_crc(path):
+	image = open_image(path)
+	return image.compute_crc32, image.size, 'B', image.close
+
+def bench_parse_response(repeat=200):
+	stream = b''.join(line + b'\r\n' for line in RECORDED_SESSION) * repeat
+	count = len(RECORDED_SESSION) * repeat
+	def run():
+		reader = ResponseReader(ReplayPort(stream))
+		for _ in range(count):
+			if reader.read_response()[0] != 0:
+				raise RuntimeError('recorded reply not parsed')
+	return run, count, 'reply', None
+
+def bench_download_pages(path, window):
+	bl = MaximBootloader('loop://', window=window)
+	port = bl.ser
+	image = open_image(path)
+	bl.set_image(image)
+	num_pages = image.header.numPages
+	def run():
+		bl.ser = AckPort()
+		bl.reader = ResponseReader(bl.ser)
+		if bl.download_pages(num_pages, 'Flashing') != 0:
+			raise RuntimeError('page not acknowledged')
+	def close():
+		bl.ser = port
+		bl.close()
+		image.close()
+	return run, num_pages * PAGE_LENGTH, 'B', close
+
+def bench_parse_key_file(count=200):
+	def run():
+		for _ in range(count):
+			parse_key_file(SAMPLE_KEY)
+	return run, count, 'file', None
+
+def bench_key_manifest(path):
+	usns = ['%048X' % (i * 7919) for i in range(1000)] + ['%048X' % ((1 << 185) + 1)]
+	def run():
+		manifest = read_key_manifest(path)
+		for usn in usns:
+			if manifest.lookup(usn) is None:
+				raise RuntimeError('USN ' + usn + ' not found')
+	return run, len(usns), 'USN', None
+
+def benchmarks(workspace):
+	"""Yields (name, setup) of every benchmark, setup returning (run, units, unit, close)."""
+	for size_kb, (bin_file, msbl_file) in sorted(workspace.images.items()):
+		suffix = '_' + str(size_kb) + 'k'
+		yield 'open_msbl' + suffix, lambda path=msbl_file: bench_open_msbl(path)
+		yield 'open_bin' + suffix, lambda path=bin_file: bench_open_bin(path)
+		yield 'msbl_crc' + suffix, lambda path=msbl_file: bench_msbl_crc(path)
+		yield 'download_pages' + suffix, lambda path=msbl_file: bench_download_pages(path, 1)
+		yield 'download_pages_w4' + suffix, lambda path=msbl_file: bench_download_pages(path, 4)
+	yield 'parse_response', bench_parse_response
+	yield 'parse_key_file', bench_parse_key_file
+	yield 'key_manifest', lambda: bench_key_manifest(workspace.manifest)
+
+
+######### Measurement #########
+# shortest time a timed pass is run for, short runs are repeated to reach it
+MIN_PASS_TIME = 0.2
+
+def median(values):
+	values = sorted(values)
+	middle = len(values) // 2
+	if len(values) % 2:
+		return values[middle]
+	return (values[middle - 1] + values[middle]) / 2.0
+
+def measure(run, units, repeat):
+	"""Median time of repeat passes, then the memory of one traced run.
+
+	A pass repeats a short run until it takes MIN_PASS_TIME. spread is the
+	range of the middle half of the passes relative to the median, the noise
+	a change is weighed against. peak_kb is the most memory held during the
+	traced run beyond what was held before it, retained_blocks the
+	allocations still alive after it.
+	"""
+	run()
+	number = max(1, int(math.ceil(MIN_PASS_TIME / max(timeit.timeit(run, number=1), 1e-6))))
+	passes = sorted(t / number for t in timeit.repeat(run, number=number, repeat=repeat))
+	seconds = median(passes)
+	quarter = len(passes) // 4
+	spread = (passes[len(passes) - 1 - quarter] - passes[quarter]) / seconds
+	result = {'rate': units / seconds, 'seconds': seconds, 'spread': round(spread, 3),
+				'peak_kb': None, 'retained_blocks': None}
+	if tracemalloc is not None:
+		tracemalloc.start()
+		try:
+			before = tracemalloc.take_snapshot()
+			start = tracemalloc.get_traced_memory()[0]
+			if hasattr(tracemalloc, 'reset_peak'):
+				tracemalloc.reset_peak()
+			run()
+			peak = tracemalloc.get_traced_memory()[1]
+			after = tracemalloc.take_snapshot()
+		finally:
+			tracemalloc.stop()
+		result['peak_kb'] = round((peak - start) / 1024.0, 1)
+		result['retained_blocks'] = sum(stat.count_diff for stat in after.compare_to(before, 'lineno'))
+	return result
+
+def format_rate(rate, unit):
+	if unit == 'B':
+		return '{:.1f} MB/s'.format(rate / (1 << 20))
+	return '{:.0f} {}/s'.format(rate, unit)
+
+def or_dash(value):
+	return '-' if value is None else value
+
+def slowdown_limit(result, base, threshold):
+	"""Slowdown, as a fraction, beyond which result is a regression: threshold,
+	or NOISE_FACTOR times the larger spread of the two runs if that is more."""
+	return max(threshold, NOISE_FACTOR * max(result.get('spread', 0), base.get('spread', 0)))
+
+def compare(name, result, base, threshold):
+	"""Returns the regressions of result against its baseline entry."""
+	problems = []
+	if result['rate'] < base['rate'] * (1 - slowdown_limit(result, base, threshold)):
+		problems.append('{:.0f}% slower'.format(100 * (1 - result['rate'] / base['rate'])))
+	# small peaks vary with the allocator, allow 64 KB on top of the threshold
+	if (result['peak_kb'] is not None and base.get('peak_kb') is not None
+			and result['peak_kb'] > base['peak_kb'] * (1 + threshold) + 64):
+		problems.append('peak memory {} KB, baseline {} KB'.format(result['peak_kb'], base['peak_kb']))
+	return problems
+
+def load_baseline(file_name):
+	try:
+		with open(file_name, 'r') as f:
+			return json.load(f)
+	except (IOError, OSError, ValueError):
+		return None
+
+def save_baseline(file_name, results):
+	baseline = {'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+				'python': platform.python_version(),
+				'machine': platform.machine(),
+				'system': platform.platform(),
+				'results': results}
+	tmp_name = file_name + '.tmp'
+	with open(tmp_name, 'w') as f:
+		json.dump(baseline, f, indent=1, sort_keys=True)
+	replace_file(tmp_name, file_name)
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("-k", "--filter", type=str, default='',
+					help="Run only the benchmarks whose name contains this text")
+	parser.add_argument("-r", "--repeat", type=int, default=15,
+					help="Timed passes of each benchmark, the median counts. Default value is 15.")
+	parser.add_argument("--sizes", type=str, default=','.join(str(s) for s in DEFAULT_SIZES),
+					metavar="KB,KB",
+					help="Comma separated sizes of the generated images in KB. "
+					"Default is " + ','.join(str(s) for s in DEFAULT_SIZES))
+	parser.add_argument("-b", "--baseline", type=str, default=DEFAULT_BASELINE, metavar="FILE",
+					help="Baseline to compare against or save to. Default is host_benchmark_baseline.json")
+	parser.add_argument("--save", action='store_true',
+					help="Save the results as the new baseline instead of comparing.")
+	parser.add_argument("-t", "--threshold", type=float, default=DEFAULT_THRESHOLD,
+					help="Slowdown or peak memory growth, as a fraction, reported as a regression. "
+					"A slowdown must also exceed " + str(NOISE_FACTOR) + " times the spread of the passes. "
+					"Default value is " + str(DEFAULT_THRESHOLD))
+	parser.add_argument('--version', action='version', version='%(prog)s ' + VERSION)
+	args = parser.parse_args()
+	init(autoreset=True)
+
+	sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+	baseline = None if args.save else load_baseline(args.baseline)
+	if baseline is not None:
+		print('Comparing with ' + args.baseline + ' (' + baseline['created'] + ', Python '
+				+ baseline['python'] + ', ' + baseline['system'] + ')')
+	if tracemalloc is None:
+		print(Fore.YELLOW + 'tracemalloc is not available, memory is not measured')
+
+	workspace = Workspace(sizes)
+	results = {}
+	regressions = 0
+	try:
+		print('{:<26} {:>14} {:>10} {:>7} {:>10} {:>8}'.format('benchmark', 'rate', 'median ms', 'spread',
+					'peak KB', 'blocks'))
+		for name, setup in benchmarks(workspace):
+			if args.filter not in name:
+				continue
+			run, units, unit, close = setup()
+			try:
+				result = measure(run, units, args.repeat)
+			finally:
+				if close is not None:
+					close()
+			result['unit'] = unit
+			results[name] = result
+			line = '{:<26} {:>14} {:>10.2f} {:>6.0f}% {:>10} {:>8}'.format(name,
+						format_rate(result['rate'], unit), result['seconds'] * 1000, result['spread'] * 100,
+						or_dash(result['peak_kb']), or_dash(result['retained_blocks']))
+			base = baseline['results'].get(name) if baseline is not None else None
+			if base is None:
+				print(line)
+				continue
+			problems = compare(name, result, base, args.threshold)
+			change = '{:+.0f}%'.format(100 * (result['rate'] / base['rate'] - 1))
+			if problems and result['seconds'] < MICRO_TIME:
+				print(Fore.YELLOW + line + '  ' + change + '  slower, not gated: ' + ', '.join(problems))
+			elif problems:
+				regressions = regressions + 1
+				print(Fore.RED + line + '  ' + change + '  REGRESSION: ' + ', '.join(problems))
+			else:
+				print(line + '  ' + change)
+	finally:
+		workspace.close()
+
+	if args.save:
+		save_baseline(args.baseline, results)
+		print('Baseline saved to ' + args.baseline)
+	elif regressions:
+		print(Fore.RED + str(regressions) + ' benchmark(s) regressed beyond '
+				+ '{:.0f}%'.format(args.threshold * 100))
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
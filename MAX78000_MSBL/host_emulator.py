@@ -0,0 +1,701 @@
+#!/usr/bin/python
+
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+# Loopback emulator of the MAX32630FTHR host firmware and the MAX78000
+# bootloader behind it. It speaks the host's text protocol on a pty pair or a
+# TCP socket so download_fw_over_host.py and configure_bootloader.py can be
+# exercised and timed without hardware.
+
+from __future__ import print_function
+import os
+import random
+import sys
+import time
+import socket
+import argparse
+import binascii
+import struct
+import zlib
+from threading import Thread, Condition
+from colorama import Fore, init
+
+VERSION = "0.1"
+
+DEFAULT_PAGE_SIZE = 8192
+PAGE_PAYLOAD_SIZE = DEFAULT_PAGE_SIZE + 16
+# seconds a board that resets into its bootloader does not answer
+RESET_BOOT_TIME = 0.2
+
+# Status values of the bootloader (MAX78000 Bootloader UG, Table 4)
+ERR_OK = 0
+ERR_UNAVAIL_CMD = 0x01
+ERR_DATA_FORMAT = 0x03
+ERR_INPUT_VALUE = 0x04
+ERR_BTLDR_GENERAL = 0x80
+ERR_BTLDR_CHECKSUM = 0x81
+ERR_BTLDR_APP_NOT_ERASED = 0x84
+ERR_BTLDR_KEY_EXIST = 0x86
+ERR_TRY_AGAIN = 0xFE
+ERR_UNKNOWN = 0xFF
+
+# commands the host answers without involving the bootloader
+host_commands = ('silent_mode', 'image_on_ram', 'set_partial_size')
+# in image_on_ram mode the host keeps the download to itself
+ram_commands = ('num_pages', 'set_iv', 'set_auth', 'flash')
+
+# set_cfg bl <field> -> get_cfg bl key
+bl_cfg_fields = {	'enter_mode' : 'enter_bl_check',
+					'enter_pin' : 'ebl_pin',
+					'enter_pol' : 'ebl_polarity',
+					'valid' : 'valid_mark_check',
+					'uart' : 'uart_enable',
+					'i2c' : 'i2c_enable',
+					'spi' : 'spi_enable',
+					'addr_i2c' : 'i2c_addr',
+					'crc' : 'crc_check',
+					'swd_lock' : 'swd_lock',
+					'exit_to' : 'ebl_timeout',
+					'exit_mode' : 'exit_bl_mode'}
+
+bl_default_config = [('enter_bl_check', 0),
+					('ebl_pin', 7),
+					('ebl_polarity', 0),
+					('valid_mark_check', 0),
+					('uart_enable', 0),
+					('i2c_enable', 1),
+					('spi_enable', 0),
+					('i2c_addr', 85),
+					('crc_check', 0),
+					('swd_lock', 0),
+					('ebl_timeout', 0),
+					('exit_bl_mode', 2)]
+
+bl_i2c_addr_index = {	0x58 : 0,
+						0x5A : 1,
+						0x5C : 2,
+						0xAA : 3}
+
+
+class LatencyModel(object):
+	"""Time the emulated host and bootloader spend on each operation.
+
+	Defaults follow the minimum delays of the MAX78000 Bootloader UG and a
+	115200 baud link with 10 bits per byte. A baudrate of 0 disables the
+	link bandwidth limit.
+	"""
+	def __init__(self, baudrate=115200, cmd_time=0.002, erase_time=0.7,
+					page_time=0.2, final_page_time=0.55, ram_page_time=0.0):
+		self.baudrate = baudrate
+		self.cmd_time = cmd_time
+		self.erase_time = erase_time
+		self.page_time = page_time
+		self.final_page_time = final_page_time
+		self.ram_page_time = ram_page_time
+
+	def link_time(self, num_bytes):
+		if not self.baudrate:
+			return 0.0
+		return num_bytes * 10.0 / self.baudrate
+
+	def wait(self, seconds):
+		if seconds > 0:
+			time.sleep(seconds)
+
+
+class FdLink(object):
+	"""Link over a file descriptor, e.g. the master side of a pty pair."""
+	def __init__(self, fd, tty_fd=None):
+		self.fd = fd
+		self.tty_fd = tty_fd
+
+	def baudrate(self):
+		# speed the client configured on the slave side of the pty
+		if self.tty_fd is None:
+			return None
+		import termios
+		speed = termios.tcgetattr(self.tty_fd)[5]
+		for name in dir(termios):
+			if name.startswith('B') and name[1:].isdigit() and getattr(termios, name) == speed:
+				return int(name[1:])
+		return None
+
+	def read(self, size):
+		try:
+			return os.read(self.fd, size)
+		except OSError:
+			# EIO on the pty master once the client closed the slave
+			return b''
+
+	def write(self, data):
+		while data:
+			written = os.write(self.fd, data)
+			data = data[written:]
+
+	def close(self):
+		pass
+
+
+class SocketLink(object):
+	"""Link over an accepted TCP connection."""
+	def __init__(self, conn):
+		self.conn = conn
+
+	def read(self, size):
+		try:
+			return self.conn.recv(size)
+		except socket.error:
+			return b''
+
+	def write(self, data):
+		self.conn.sendall(data)
+
+	def baudrate(self):
+		return None
+
+	def close(self):
+		self.conn.close()
+
+
+class MaximHostEmulator(object):
+	def __init__(self, latency=None, bl_version='3.4.4', usn=None, verbose=False,
+					host_buffer_pages=1, max_baudrate=None, follow_baudrate=False,
+					early_ack=False, swap_time=None, fail_pages=(), board_comm=None,
+					min_delay_factor=0, reset_to_bootloader=False):
+		self.latency = latency if latency is not None else LatencyModel()
+		# ack erase and config save right away and stay busy in the background
+		self.early_ack = early_ack
+		self.busy_until = 0
+		self.max_baudrate = max_baudrate
+		self.follow_baudrate = follow_baudrate
+		# bytes the host accepts from the link while it is busy with a command
+		# or a page, which is what lets a pipelining client overlap transfers
+		self.rx_capacity = max(4096, host_buffer_pages * PAGE_PAYLOAD_SIZE)
+		self.bl_version = bl_version
+		# seconds between a board leaving the bootloader and the next board
+		# answering, None keeps the same board attached forever
+		self.swap_time = swap_time
+		self.board_ready_at = 0
+		# the board left the bootloader for its application, which answers
+		# only what brings it back: bootldr and image_flash
+		self.running_app = False
+		# reset restarts the same board into its bootloader, as with the
+		# entry pin held or a bootloader that waits for the host
+		self.reset_to_bootloader = reset_to_bootloader
+		# page programs, counted from start, answered with a checksum error
+		# as if the page had been corrupted on the link
+		self.fail_pages = set(fail_pages)
+		self.page_programs = 0
+		# interface the board is wired to, None answers on any
+		self.board_comm = board_comm
+		# pages flashed with a lower delay factor come out corrupted
+		self.min_delay_factor = min_delay_factor
+		self.usn = usn if usn is not None else '00112233445566778899AABBCCDDEEFF0011223344556677'
+		self.verbose = verbose
+		self.config = dict(bl_default_config)
+		self.saved_config = dict(bl_default_config)
+		self.key = None
+		self.flash = {}
+		self.ram_image = {}
+		self.stats = dict((name, 0) for name in ('commands', 'erases', 'pages_programmed',
+					'pages_to_ram', 'config_saves', 'exits', 'resets', 'boards', 'bytes_in', 'bytes_out'))
+		self.reset_host()
+
+	def reset_host(self):
+		self.silent = False
+		self.ebl_mode = 0
+		self.delay_factor = 1
+		self.comm = 'i2c'
+		self.partial_size = None
+		self.image_on_ram = False
+		self.reset_target()
+
+	def reset_target(self):
+		self.in_bootloader = False
+		self.num_pages = 0
+		if not self.image_on_ram:
+			# with image_on_ram the IV and auth bytes go with the image in
+			# host RAM and are used again for every board
+			self.iv = bytearray(11)
+			self.auth = bytearray(16)
+		self.erased = False
+		self.flash_pages_left = 0
+		self.flash_page_index = 0
+		self.flash_to_ram = False
+
+	######### Link #########
+	def serve(self, link):
+		self.link = link
+		self.rx = bytearray()
+		self.rx_closed = False
+		self.rx_cond = Condition()
+		reader = Thread(target=self.receive_loop)
+		reader.daemon = True
+		reader.start()
+		while True:
+			if self.flash_pages_left > 0:
+				page = self.read_exact(PAGE_PAYLOAD_SIZE)
+				if page is None:
+					break
+				self.receive_page(page)
+				continue
+			line = self.read_line()
+			if line is None:
+				break
+			line = line.strip()
+			if line:
+				self.handle_command(line.decode('ascii', 'replace'))
+		link.close()
+
+	def receive_loop(self):
+		# Moves bytes from the link at link speed, independent of how long the
+		# host takes to process what it already has.
+		while True:
+			with self.rx_cond:
+				while len(self.rx) >= self.rx_capacity:
+					self.rx_cond.wait()
+			data = self.link.read(4096)
+			if data:
+				self.stats['bytes_in'] += len(data)
+				baudrate = self.link.baudrate()
+				if self.follow_baudrate and baudrate:
+					self.latency.baudrate = baudrate
+				self.latency.wait(self.latency.link_time(len(data)))
+				if self.max_baudrate and baudrate and baudrate > self.max_baudrate:
+					# the host UART cannot follow, bytes arrive as framing errors
+					continue
+			with self.rx_cond:
+				if not data:
+					self.rx_closed = True
+				self.rx.extend(data)
+				self.rx_cond.notify_all()
+			if not data:
+				return
+
+	def take(self, size):
+		data = bytes(self.rx[:size])
+		del self.rx[:size]
+		self.rx_cond.notify_all()
+		return data
+
+	def read_line(self):
+		with self.rx_cond:
+			while True:
+				pos = self.rx.find(b'\n')
+				if pos >= 0:
+					line = self.take(pos + 1)
+					return line[:-1]
+				if self.rx_closed:
+					return None
+				if len(self.rx) >= self.rx_capacity:
+					# no command is that long, the host drops it like stray page data
+					self.take(len(self.rx))
+					continue
+				self.rx_cond.wait()
+
+	def read_exact(self, size):
+		with self.rx_cond:
+			while len(self.rx) < size:
+				if self.rx_closed:
+					return None
+				self.rx_cond.wait()
+			return self.take(size)
+
+	def send_line(self, line):
+		data = (line + '\r\n').encode('ascii', 'replace')
+		self.latency.wait(self.latency.link_time(len(data)))
+		self.stats['bytes_out'] += len(data)
+		self.link.write(data)
+		if self.verbose:
+			print('<< ' + line)
+
+	def reply(self, cmd, err, values=()):
+		fields = [cmd] + [str(key) + '=' + str(value) for key, value in values]
+		fields.append('err=' + str(err))
+		self.send_line(' '.join(fields))
+
+	######### Commands #########
+	def handle_command(self, line):
+		if self.verbose:
+			print('>> ' + line)
+		self.stats['commands'] += 1
+		args = line.split()
+		cmd = args[0]
+		handler = getattr(self, 'cmd_' + cmd, None)
+		if handler is None:
+			self.reply(cmd, ERR_UNAVAIL_CMD)
+			return
+		self.latency.wait(self.latency.cmd_time * max(self.delay_factor, 1))
+		if (time.time() < self.board_ready_at or self.board_comm not in (None, self.comm)) \
+				and not self.is_host_command(cmd, args):
+			# no board on the target interface
+			self.reply(cmd, ERR_UNKNOWN)
+			return
+		if self.running_app and cmd not in ('bootldr', 'image_flash') \
+				and not self.is_host_command(cmd, args):
+			self.reply(cmd, ERR_UNKNOWN)
+			return
+		if time.time() < self.busy_until and not self.is_host_command(cmd, args):
+			self.reply(cmd, ERR_TRY_AGAIN)
+			return
+		try:
+			handler(cmd, args[1:])
+		except (IndexError, ValueError):
+			self.reply(cmd, ERR_DATA_FORMAT)
+
+	def is_host_command(self, cmd, args):
+		if self.image_on_ram and cmd in ram_commands:
+			return True
+		return cmd in host_commands or (cmd == 'set_cfg' and args[:1] != ['bl'])
+
+	def busy(self, seconds):
+		if self.early_ack:
+			self.busy_until = time.time() + seconds
+		else:
+			self.latency.wait(seconds)
+
+	def cmd_silent_mode(self, cmd, args):
+		self.silent = args[0] == '1'
+		self.reply(cmd, ERR_OK)
+
+	def cmd_bootldr(self, cmd, args):
+		self.in_bootloader = True
+		self.running_app = False
+		self.reply(cmd, ERR_OK)
+
+	def cmd_get_device_info(self, cmd, args):
+		self.reply(cmd, ERR_OK, [('platform_type', 5), ('hub_firm_ver', self.bl_version)])
+
+	def cmd_page_size(self, cmd, args):
+		self.reply(cmd, ERR_OK, [('value', DEFAULT_PAGE_SIZE)])
+
+	def cmd_get_usn(self, cmd, args):
+		self.reply(cmd, ERR_OK, [('value', self.usn)])
+
+	def cmd_image_on_ram(self, cmd, args):
+		self.image_on_ram = args[0] == '1'
+		self.reply(cmd, ERR_OK)
+
+	def cmd_num_pages(self, cmd, args):
+		num_pages = int(args[0])
+		if num_pages <= 0:
+			self.reply(cmd, ERR_INPUT_VALUE)
+			return
+		self.num_pages = num_pages
+		self.reply(cmd, ERR_OK)
+
+	def cmd_set_iv(self, cmd, args):
+		iv = bytearray(binascii.unhexlify(args[0]))
+		if len(iv) != len(self.iv):
+			self.reply(cmd, ERR_DATA_FORMAT)
+			return
+		self.iv = iv
+		self.reply(cmd, ERR_OK)
+
+	def cmd_set_auth(self, cmd, args):
+		auth = bytearray(binascii.unhexlify(args[0]))
+		if len(auth) != len(self.auth):
+			self.reply(cmd, ERR_DATA_FORMAT)
+			return
+		self.auth = auth
+		self.reply(cmd, ERR_OK)
+
+	def cmd_set_partial_size(self, cmd, args):
+		size = int(args[0])
+		if not 1 <= size <= PAGE_PAYLOAD_SIZE:
+			self.reply(cmd, ERR_INPUT_VALUE)
+			return
+		self.partial_size = size
+		self.reply(cmd, ERR_OK)
+
+	def cmd_set_key(self, cmd, args):
+		if self.key is not None:
+			self.reply(cmd, ERR_BTLDR_KEY_EXIST)
+			return
+		self.key = args[0]
+		self.latency.wait(0.2)
+		self.reply(cmd, ERR_OK)
+
+	def cmd_erase(self, cmd, args):
+		self.erase_target(True)
+		self.reply(cmd, ERR_OK)
+
+	def cmd_flash(self, cmd, args):
+		if self.num_pages == 0:
+			self.reply(cmd, ERR_BTLDR_GENERAL)
+			return
+		if not self.image_on_ram and not self.erased:
+			self.reply(cmd, ERR_BTLDR_APP_NOT_ERASED)
+			return
+		self.flash_to_ram = self.image_on_ram
+		if self.flash_to_ram:
+			self.ram_image = {}
+		self.flash_pages_left = self.num_pages
+		self.flash_page_index = 0
+		self.reply(cmd, ERR_OK)
+
+	def cmd_image_flash(self, cmd, args):
+		num_pages = len(self.ram_image)
+		if num_pages == 0:
+			self.reply(cmd, ERR_BTLDR_GENERAL)
+			return
+		self.reply(cmd, ERR_OK)
+		self.in_bootloader = True
+		self.running_app = False
+		self.erase_target()
+		for i in range(num_pages):
+			err = self.program_page(i, self.ram_image[i], i == num_pages - 1)
+			# progress line followed by the status line of the page
+			self.send_line('image_flash page=' + str(i + 1) + '/' + str(num_pages))
+			self.reply(cmd, err, [('page', i + 1)])
+
+	def cmd_exit(self, cmd, args):
+		self.stats['exits'] += 1
+		self.reply(cmd, ERR_OK)
+		self.reset_target()
+		self.running_app = True
+		self.swap_board()
+
+	def cmd_reset(self, cmd, args):
+		self.stats['resets'] += 1
+		self.reply(cmd, ERR_OK)
+		self.reset_target()
+		if self.reset_to_bootloader:
+			self.board_ready_at = time.time() + RESET_BOOT_TIME
+			return
+		self.running_app = True
+		self.swap_board()
+
+	def swap_board(self):
+		# the operator takes the board off the fixture and puts the next one on
+		if self.swap_time is None:
+			return
+		self.stats['boards'] += 1
+		self.board_ready_at = time.time() + self.swap_time
+		self.usn = '%048X' % random.getrandbits(192)
+		self.flash = {}
+		self.key = None
+		# a blank board has no application and waits in the bootloader
+		self.running_app = False
+
+	def cmd_set_cfg(self, cmd, args):
+		if args[0] == 'host':
+			if args[1] == 'ebl':
+				self.ebl_mode = int(args[2])
+			elif args[1] == 'cdf':
+				self.delay_factor = int(args[2])
+			else:
+				self.reply(cmd, ERR_INPUT_VALUE)
+				return
+		elif args[0] == 'comm':
+			if args[1] not in ('i2c', 'spi', 'uart'):
+				self.reply(cmd, ERR_INPUT_VALUE)
+				return
+			self.comm = args[1]
+		elif args[0] == 'bl':
+			if args[1] == 'save':
+				self.busy(self.latency.page_time)
+				self.saved_config = dict(self.config)
+				self.stats['config_saves'] += 1
+			elif args[1] == 'addr_i2c' and self.bl_version_tuple() < (3, 4, 2):
+				# older bootloaders take the index of one of four addresses
+				addresses = dict((index, addr) for addr, index in bl_i2c_addr_index.items())
+				if int(args[-1]) not in addresses:
+					self.reply(cmd, ERR_INPUT_VALUE)
+					return
+				self.config['i2c_addr'] = addresses[int(args[-1])]
+			elif args[1] in bl_cfg_fields:
+				# enter_pin takes port and pin, the rest a single value
+				self.config[bl_cfg_fields[args[1]]] = int(args[-1])
+			else:
+				self.reply(cmd, ERR_INPUT_VALUE)
+				return
+		else:
+			self.reply(cmd, ERR_INPUT_VALUE)
+			return
+		self.reply(cmd, ERR_OK)
+
+	def cmd_get_cfg(self, cmd, args):
+		if args[0] != 'bl':
+			self.reply(cmd, ERR_INPUT_VALUE)
+			return
+		values = []
+		for key, _ in bl_default_config:
+			value = self.config[key]
+			if key == 'i2c_addr' and self.bl_version_tuple() < (3, 4, 2):
+				value = bl_i2c_addr_index.get(value, 0)
+			values.append((key, value))
+		self.reply(cmd, ERR_OK, values)
+
+	######### Target #########
+	def bl_version_tuple(self):
+		return tuple(int(part) for part in self.bl_version.split('.'))
+
+	def erase_target(self, background=False):
+		if background:
+			self.busy(self.latency.erase_time)
+		else:
+			self.latency.wait(self.latency.erase_time)
+		self.flash = {}
+		self.erased = True
+		self.stats['erases'] += 1
+
+	def receive_page(self, page):
+		i = self.flash_page_index
+		self.flash_page_index += 1
+		self.flash_pages_left -= 1
+		if self.flash_to_ram:
+			self.latency.wait(self.latency.ram_page_time)
+			self.ram_image[i] = page
+			self.stats['pages_to_ram'] += 1
+			err = ERR_OK
+		else:
+			err = self.program_page(i, page, self.flash_pages_left == 0)
+		if err != ERR_OK:
+			self.flash_pages_left = 0
+		self.reply('flash', err, [('page', i + 1)])
+
+	def program_page(self, index, page, final):
+		if final and self.config['crc_check']:
+			self.latency.wait(self.latency.final_page_time)
+		else:
+			self.latency.wait(self.latency.page_time)
+		self.page_programs += 1
+		if self.page_programs in self.fail_pages or self.delay_factor < self.min_delay_factor:
+			return ERR_BTLDR_CHECKSUM
+		if not any(bytearray(self.iv)):
+			# plain image, the page CRC can be checked without the key
+			crc = struct.unpack('<I', page[DEFAULT_PAGE_SIZE:DEFAULT_PAGE_SIZE + 4])[0]
+			if zlib.crc32(page[:DEFAULT_PAGE_SIZE]) & 0xFFFFFFFF != crc:
+				return ERR_BTLDR_CHECKSUM
+		self.flash[index] = page
+		self.stats['pages_programmed'] += 1
+		return ERR_OK
+
+	def print_stats(self):
+		print(Fore.CYAN + 'Emulator stats: ' + ', '.join(
+					key + '=' + str(self.stats[key]) for key in sorted(self.stats)))
+
+
+def open_pty():
+	import pty
+	import tty
+	master, slave = pty.openpty()
+	tty.setraw(slave)
+	return master, slave, os.ttyname(slave)
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("-t", "--tcp", type=int, metavar="PORT",
+					help="Listen on a TCP port instead of creating a pty pair.")
+	parser.add_argument("--bind", type=str, default="127.0.0.1",
+					help="Address to bind in TCP mode. Default is 127.0.0.1")
+	parser.add_argument("-b", "--baudrate", type=int, default=115200,
+					help="Emulated link speed in bits/s, 0 for unlimited. Default is 115200")
+	parser.add_argument("--max_baudrate", type=int,
+					help="Highest baud rate the host understands, faster clients only produce framing errors.")
+	parser.add_argument("--follow_baudrate", action='store_true',
+					help="Use the baud rate the client set on the pty as link speed instead of -b.")
+	parser.add_argument("--early_ack", action='store_true',
+					help="Acknowledge erase and config save at once and answer try-again while busy.")
+	parser.add_argument("--cmd_time", type=float, default=0.002,
+					help="Processing time of a command in seconds. Default is 0.002")
+	parser.add_argument("--erase_time", type=float, default=0.7,
+					help="Application erase time in seconds. Default is 0.7")
+	parser.add_argument("--page_time", type=float, default=0.2,
+					help="Programming time of a page in seconds. Default is 0.2")
+	parser.add_argument("--final_page_time", type=float, default=0.55,
+					help="Programming time of the last page when crc check is enabled. Default is 0.55")
+	parser.add_argument("--host_buffer", type=int, default=1,
+					help="Pages the host buffers from the link while flashing a page. Default is 1")
+	parser.add_argument("--bl_version", type=str, default="3.4.4",
+					help="Bootloader version reported by get_device_info. Default is 3.4.4")
+	parser.add_argument("--swap_time", type=float,
+					help="Replace the board after every exit or reset: no board answers for SWAP_TIME "
+					"seconds, then a blank board with a new USN does.")
+	parser.add_argument("--reset_to_bootloader", action='store_true',
+					help="After reset the same board goes quiet for a moment, then answers from its "
+					"bootloader again instead of running its application.")
+	parser.add_argument("--fail_pages", type=str, default="",
+					help="Comma separated numbers of page programs, counted from start, that fail with "
+					"a checksum error, for example 3,10 fails the third and the tenth page flashed.")
+	parser.add_argument("--comm", type=str, choices=['i2c', 'spi', 'uart'],
+					help="Interface the board is wired to, target commands over another one are not "
+					"answered (err=255). Default is any.")
+	parser.add_argument("--min_delay_factor", type=int, default=0,
+					help="Lowest delay factor the bootloader keeps up with, pages flashed with a lower "
+					"one fail with a checksum error. Default is 0")
+	parser.add_argument("-v", "--verbose", action='store_true',
+					help="Print every command and reply.")
+	parser.add_argument('--version', action='version', version='%(prog)s ' + VERSION)
+	args = parser.parse_args()
+	init(autoreset=True)
+
+	latency = LatencyModel(args.baudrate, args.cmd_time, args.erase_time,
+					args.page_time, args.final_page_time)
+	emulator = MaximHostEmulator(latency, args.bl_version, verbose=args.verbose,
+					host_buffer_pages=args.host_buffer, max_baudrate=args.max_baudrate,
+					follow_baudrate=args.follow_baudrate, early_ack=args.early_ack,
+					swap_time=args.swap_time,
+					fail_pages=[int(n) for n in args.fail_pages.split(',') if n.strip()],
+					board_comm=args.comm, min_delay_factor=args.min_delay_factor,
+					reset_to_bootloader=args.reset_to_bootloader)
+	print(Fore.CYAN + '\n\nMAXIM HOST EMULATOR ' + VERSION + '\n\n')
+	try:
+		if args.tcp is not None:
+			server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			server.bind((args.bind, args.tcp))
+			server.listen(1)
+			print('Listening on ' + args.bind + ':' + str(server.getsockname()[1]))
+			sys.stdout.flush()
+			while True:
+				conn, addr = server.accept()
+				conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+				print('Connection from ' + str(addr[0]) + ':' + str(addr[1]))
+				emulator.reset_host()
+				emulator.serve(SocketLink(conn))
+				emulator.print_stats()
+		else:
+			master, slave, name = open_pty()
+			print('Port: ' + name)
+			sys.stdout.flush()
+			# the slave stays open here, so clients can come and go
+			emulator.serve(FdLink(master, slave))
+	except KeyboardInterrupt:
+		emulator.print_stats()
+		sys.exit(0)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,465 @@
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+# Serial link helpers shared by download_fw_over_host.py and
+# configure_bootloader.py.
+
+from __future__ import print_function
+import os
+import re
+import glob
+import json
+import time
+import threading
+
+DEFAULT_BAUDRATES = [921600, 460800, 230400, 115200]
+FALLBACK_BAUDRATE = 115200
+
+STATE_DIR = os.environ.get('MAXIM_BL_STATE_DIR',
+				os.path.join(os.path.expanduser('~'), '.maxim_bootloader'))
+
+# cheap commands that are answered by the bootloader and by the host alone
+BL_READY_CMD = 'page_size\n'
+HOST_READY_CMD = 'silent_mode 1\n'
+
+_err_pattern = re.compile(br'(^|\s)err=-?\d+')
+
+
+def parse_baudrates(text):
+	"""Parses a comma separated baud rate list such as '921600,115200'."""
+	rates = [int(item) for item in text.split(',') if item.strip()]
+	if not rates or min(rates) <= 0:
+		raise ValueError('invalid baud rate list: ' + text)
+	return rates
+
+
+def expand_ports(port_arg):
+	"""Ports of a -p argument: a comma separated list of names, globs such as
+	/dev/ttyACM* expanded."""
+	ports = []
+	for item in port_arg.split(','):
+		item = item.strip()
+		if any(c in item for c in '*?['):
+			ports.extend(sorted(glob.glob(item)))
+		elif item:
+			ports.append(item)
+	return ports
+
+
+def replace_file(src, dst):
+	if hasattr(os, 'replace'):
+		os.replace(src, dst)
+	else:
+		os.rename(src, dst)
+
+
+class StateFile(object):
+	"""Json file under STATE_DIR holding one entry per key (a port, a USN).
+
+	Several ports may be served by threads of one process, so updates are
+	serialized and written through a temporary file. update and remove return
+	False when the file could not be written.
+	"""
+	_lock = threading.Lock()
+	default_name = 'state.json'
+
+	def __init__(self, file_name=None):
+		if file_name is None:
+			file_name = os.path.join(STATE_DIR, self.default_name)
+		self.file_name = file_name
+
+	def load(self):
+		try:
+			with open(self.file_name, 'r') as f:
+				return json.load(f)
+		except (IOError, OSError, ValueError):
+			return {}
+
+	def get(self, item):
+		return self.load().get(item, {})
+
+	def update(self, item, **values):
+		with self._lock:
+			entries = self.load()
+			entry = entries.setdefault(item, {})
+			for name, value in values.items():
+				if value is None:
+					entry.pop(name, None)
+				else:
+					entry[name] = value
+			return self._save(entries)
+
+	def remove(self, *items):
+		if not items:
+			return True
+		with self._lock:
+			entries = self.load()
+			for item in items:
+				entries.pop(item, None)
+			return self._save(entries)
+
+	def _save(self, entries):
+		try:
+			directory = os.path.dirname(self.file_name)
+			if directory and not os.path.isdir(directory):
+				os.makedirs(directory)
+			tmp_name = self.file_name + '.tmp'
+			with open(tmp_name, 'w') as f:
+				json.dump(entries, f, indent=1, sort_keys=True)
+			replace_file(tmp_name, self.file_name)
+		except (IOError, OSError):
+			return False
+		return True
+
+
+class StateLog(StateFile):
+	"""Append-only json lines file under STATE_DIR, one line per change.
+
+	For files that grow with every board, such as the ledgers: update and
+	remove append a line instead of rewriting the file, load replays the
+	lines so the values set last for an item win. A line cut short by a
+	crash is skipped.
+	"""
+	default_name = 'state.jsonl'
+	item_name = 'item'
+
+	def load(self):
+		entries = {}
+		try:
+			with open(self.file_name, 'r') as f:
+				for line in f:
+					try:
+						change = json.loads(line)
+						item = change.pop(self.item_name)
+					except (ValueError, KeyError, AttributeError):
+						continue
+					if change.pop('removed', False):
+						entries.pop(item, None)
+						continue
+					entry = entries.setdefault(item, {})
+					for name, value in change.items():
+						if value is None:
+							entry.pop(name, None)
+						else:
+							entry[name] = value
+		except (IOError, OSError):
+			pass
+		return entries
+
+	def update(self, item, **values):
+		values[self.item_name] = item
+		return self._append([values])
+
+	def remove(self, *items):
+		return self._append([{self.item_name: item, 'removed': True} for item in items])
+
+	def _append(self, changes):
+		if not changes:
+			return True
+		# one write per call, so lines of concurrent writers do not interleave
+		lines = ''.join(json.dumps(change, sort_keys=True) + '\n' for change in changes)
+		with self._lock:
+			try:
+				directory = os.path.dirname(self.file_name)
+				if directory and not os.path.isdir(directory):
+					os.makedirs(directory)
+				with open(self.file_name, 'a+b') as f:
+					f.seek(0, os.SEEK_END)
+					if f.tell() > 0:
+						# end a line cut short by a crash, or it swallows this one
+						f.seek(-1, os.SEEK_END)
+						if f.read(1) != b'\n':
+							lines = '\n' + lines
+					f.write(lines.encode('utf-8'))
+			except (IOError, OSError):
+				return False
+		return True
+
+
+class LinkSettings(StateFile):
+	"""Per-port link settings such as the negotiated baud rate."""
+	default_name = 'links.json'
+
+
+class TuningSettings(StateFile):
+	"""Send size, delay factor and interface found by --tune, per port and board type."""
+	default_name = 'tuning.json'
+
+	@staticmethod
+	def item(port, board):
+		return port + '|' + board
+
+	def lookup(self, port, board=None):
+		"""Returns the entry of port and board, or with no board the latest
+		tuned on port; {} if there is none."""
+		entries = self.load()
+		if board is not None:
+			return entries.get(self.item(port, board), {})
+		tuned = [entry for item, entry in entries.items() if item.rpartition('|')[0] == port]
+		if not tuned:
+			return {}
+		return max(tuned, key=lambda entry: entry.get('time', ''))
+
+
+def to_text(data):
+	"""Bytes from the port as str on Python 2 and 3."""
+	if isinstance(data, str):
+		return data
+	return data.decode('latin-1')
+
+
+class Response(object):
+	"""A parsed `cmd key=value ... err=N` reply.
+
+	Indexes like the [err, values] lists the scripts used to return, so
+	ret[0] is the error code and ret[1] the dict of the other fields.
+	"""
+	__slots__ = ('err', 'values')
+
+	def __init__(self, err, values):
+		self.err = err
+		self.values = values
+
+	def __len__(self):
+		return 2
+
+	def __getitem__(self, index):
+		if index == 0:
+			return self.err
+		if index == 1:
+			return self.values
+		raise IndexError('response index out of range')
+
+	def __repr__(self):
+		return 'Response(err=' + str(self.err) + ', ' + repr(self.values) + ')'
+
+
+def parse_reply(line):
+	"""Returns the Response of a reply line, or None for lines without err=."""
+	if b'err=' not in line:
+		return None
+	values = {}
+	fields = line.split()
+	for field in fields[1:]:
+		key, _, value = field.partition(b'=')
+		values[to_text(key)] = to_text(value)
+	try:
+		return Response(int(values['err']), values)
+	except (KeyError, ValueError):
+		return None
+
+
+class LineBuffer(object):
+	"""Reusable receive buffer that frames lines as bytes arrive.
+
+	Only the bytes added since the last scan are searched for a line end.
+	"""
+	def __init__(self):
+		self.buf = bytearray()
+		self.start = 0
+		self.scan = 0
+
+	def clear(self):
+		del self.buf[:]
+		self.start = 0
+		self.scan = 0
+
+	def feed(self, data):
+		if self.start:
+			del self.buf[:self.start]
+			self.scan = self.scan - self.start
+			self.start = 0
+		self.buf += data
+
+	def next_line(self):
+		"""Returns the next complete line without its terminator, or None."""
+		end = self.buf.find(b'\n', self.scan)
+		if end < 0:
+			self.scan = len(self.buf)
+			return None
+		line = bytes(self.buf[self.start:end])
+		self.start = end + 1
+		self.scan = self.start
+		if self.start == len(self.buf):
+			self.clear()
+		return line
+
+
+class ResponseReader(object):
+	"""Frames host replies from whatever bytes the port has available.
+
+	Each read takes everything already received (at least one byte, waiting
+	up to the port timeout), so a reply costs one or two system calls
+	instead of one per byte, and lines are found by scanning only the bytes
+	that arrived since the last scan. Progress lines and blank lines are
+	skipped. A timeout returns err -1 instead of retrying forever.
+	"""
+	def __init__(self, ser):
+		self.ser = ser
+		self.lines = LineBuffer()
+
+	def clear(self):
+		self.lines.clear()
+
+	def read_line(self):
+		"""Returns the next line without its terminator, or None on timeout."""
+		while True:
+			line = self.lines.next_line()
+			if line is not None:
+				return line
+			data = self.ser.read(max(1, self.ser.in_waiting))
+			if not data:
+				return None
+			self.lines.feed(data)
+
+	def read_response(self):
+		while True:
+			try:
+				line = self.read_line()
+			except (OSError, IOError, ValueError):
+				return Response(-1, {})
+			if line is None:
+				return Response(-1, {})
+			response = parse_reply(line)
+			if response is not None:
+				return response
+
+
+def probe_link(ser, timeout=0.5, rounds=2):
+	"""Returns True if the host answers `silent_mode 1` at the current speed.
+
+	silent_mode only touches the host, so it is safe to repeat at any time.
+	Every round must get an err= reply before the deadline.
+	"""
+	saved_timeout = ser.timeout
+	ser.timeout = timeout
+	try:
+		ser.reset_input_buffer()
+		for _ in range(rounds):
+			ser.write(b'silent_mode 1\n')
+			deadline = time.time() + timeout
+			while True:
+				line = ser.readline()
+				if _err_pattern.search(line):
+					break
+				if time.time() >= deadline:
+					return False
+		return True
+	finally:
+		ser.timeout = saved_timeout
+
+
+def wait_until_ready(send_str_cmd, timeout, cmd=BL_READY_CMD, interval=0.02):
+	"""Polls with a status command until it succeeds or timeout expires.
+
+	Replaces fixed worst-case sleeps: the call returns as soon as the device
+	answers err=0, so an operation costs only as long as the device needs.
+	Returns the error of the last poll.
+	"""
+	deadline = time.time() + timeout
+	while True:
+		ret = send_str_cmd(cmd)
+		if ret[0] == 0 or time.time() >= deadline:
+			return ret[0]
+		time.sleep(interval)
+
+
+def negotiate_baudrate(ser, port, candidates=None, settings=None, output=None):
+	"""Switches ser to the fastest candidate baud rate the host answers at.
+
+	Rates faster than the one recorded for the port that have not failed
+	before are tried first, then the recorded rate, then the rest from the
+	highest down. The outcome is recorded for the next run. Returns the
+	chosen rate, or None when the host did not answer at any rate, in which
+	case the port is left at FALLBACK_BAUDRATE. Rates that do not answer are
+	reported to output(message) when given.
+	"""
+	if candidates is None:
+		candidates = DEFAULT_BAUDRATES
+	if settings is None:
+		settings = LinkSettings()
+	entry = settings.get(port)
+	failed = list(entry.get('failed', []))
+
+	chosen = None
+	for rate in baudrate_order(candidates, entry):
+		ser.baudrate = rate
+		if probe_link(ser):
+			chosen = rate
+			break
+		if output is not None:
+			output('No response from host at ' + str(rate) + ' baud')
+		if rate not in failed:
+			failed.append(rate)
+
+	if chosen is None:
+		ser.baudrate = FALLBACK_BAUDRATE
+	record_baudrate(settings, port, entry, chosen, failed)
+	return chosen
+
+
+def baudrate_order(candidates, entry):
+	"""Order in which negotiate_baudrate probes candidates for a port entry."""
+	known = entry.get('baudrate')
+	failed = entry.get('failed', [])
+	rates = sorted(set(candidates), reverse=True)
+	untried = [rate for rate in rates if rate not in failed and (known is None or rate > known)]
+	order = untried + [rate for rate in rates if rate == known and rate not in untried]
+	return order + [rate for rate in rates if rate not in order]
+
+
+def record_baudrate(settings, port, entry, chosen, failed):
+	"""Saves the outcome of a negotiation if it differs from entry."""
+	if chosen is not None:
+		failed = [rate for rate in failed if rate != chosen]
+	if chosen != entry.get('baudrate') or sorted(failed) != entry.get('failed', []):
+		settings.update(port, baudrate=chosen, failed=sorted(failed) or None)
+
+
+def fall_back_baudrate(ser, candidates=None):
+	"""Drops to the fastest candidate below the current rate the host answers at.
+
+	Meant for link errors during a session, and only for that session: the
+	link settings are left alone, so one bad transfer does not keep a rate
+	from being tried first next time. Returns the new rate, or None when no
+	slower rate answers, in which case the port stays at its current rate.
+	"""
+	if candidates is None:
+		candidates = DEFAULT_BAUDRATES
+	current = ser.baudrate
+	for rate in sorted(set(rate for rate in candidates if rate < current), reverse=True):
+		ser.baudrate = rate
+		if probe_link(ser):
+			return rate
+	ser.baudrate = current
+	return None
@@ -0,0 +1,190 @@
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+# Per-phase timing of a flash cycle, exported with --profile.
+
+from __future__ import print_function
+import os
+import csv
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+EVENT_FIELDS = ['port', 'phase', 'index', 'op', 'start', 'duration', 'bytes']
+SUMMARY_FIELDS = ['phase', 'op', 'count', 'total', 'mean', 'median', 'min', 'max', 'bytes']
+
+
+class PhaseProfiler(object):
+	"""Collects timestamped events of the protocol phases of one or more ports.
+
+	A phase ('open', 'erase', 'page', ...) covers everything done while it is
+	open, its 'total' event is the wall-clock time of the phase. Inside it,
+	'write' events measure the time spent handing bytes to the serial driver
+	and 'wait' events the time spent waiting for a response. Each thread (one
+	per port) keeps its own phase stack, events of all threads are collected
+	in one list.
+	"""
+	def __init__(self):
+		self.t0 = time.time()
+		self.events = []
+		self.lock = threading.Lock()
+		self.local = threading.local()
+
+	def stack(self):
+		if not hasattr(self.local, 'stack'):
+			self.local.stack = []
+		return self.local.stack
+
+	def current(self):
+		stack = self.stack()
+		if stack:
+			return stack[-1]
+		return (None, None)
+
+	@contextmanager
+	def phase(self, name, index=None, port=None):
+		stack = self.stack()
+		stack.append((name, index))
+		start = time.time()
+		try:
+			yield
+		finally:
+			stack.pop()
+			self.add(port, name, index, 'total', start, time.time() - start, 0)
+
+	def record(self, op, start, nbytes=0, port=None, phase=None, index=None):
+		"""Records an op that started at start and ends now."""
+		if phase is None:
+			phase, index = self.current()
+			if phase is None:
+				phase = 'other'
+		self.add(port, phase, index, op, start, time.time() - start, nbytes)
+
+	def add(self, port, phase, index, op, start, duration, nbytes):
+		event = {'port': port, 'phase': phase, 'index': index, 'op': op,
+					'start': round(start - self.t0, 6), 'duration': round(duration, 6),
+					'bytes': nbytes}
+		with self.lock:
+			self.events.append(event)
+
+	def summary(self):
+		groups = {}
+		order = []
+		with self.lock:
+			events = list(self.events)
+		for event in events:
+			key = (event['phase'], event['op'])
+			if key not in groups:
+				groups[key] = []
+				order.append(key)
+			groups[key].append(event)
+		rows = []
+		for key in order:
+			durations = sorted(event['duration'] for event in groups[key])
+			count = len(durations)
+			middle = count // 2
+			if count % 2:
+				median = durations[middle]
+			else:
+				median = (durations[middle - 1] + durations[middle]) / 2.0
+			rows.append({'phase': key[0], 'op': key[1], 'count': count,
+						'total': round(sum(durations), 6),
+						'mean': round(sum(durations) / count, 6),
+						'median': round(median, 6),
+						'min': durations[0], 'max': durations[-1],
+						'bytes': sum(event['bytes'] for event in groups[key])})
+		return rows
+
+	def totals(self):
+		"""Wall time of the run and the part of it spent writing and waiting."""
+		with self.lock:
+			events = list(self.events)
+		wall = 0.0
+		if events:
+			wall = max(event['start'] + event['duration'] for event in events)
+		write = sum(event['duration'] for event in events if event['op'] == 'write')
+		wait = sum(event['duration'] for event in events if event['op'] == 'wait')
+		return {'wall': round(wall, 6), 'write': round(write, 6), 'wait': round(wait, 6),
+				'other': round(max(0.0, wall - write - wait), 6)}
+
+	def save(self, file_name):
+		"""Writes the profile as CSV if file_name ends with .csv, else as JSON."""
+		extension = os.path.splitext(file_name)[1].lower()
+		if extension == '.csv':
+			self.save_csv(file_name)
+		else:
+			self.save_json(file_name)
+
+	def save_json(self, file_name):
+		with self.lock:
+			events = list(self.events)
+		with open(file_name, 'w') as f:
+			json.dump({'totals': self.totals(), 'summary': self.summary(), 'events': events},
+						f, indent=1, sort_keys=True)
+
+	def save_csv(self, file_name):
+		# summary table first, then a blank row and the raw events
+		with self.lock:
+			events = list(self.events)
+		with open(file_name, 'w') as f:
+			writer = csv.DictWriter(f, SUMMARY_FIELDS, lineterminator='\n')
+			writer.writeheader()
+			writer.writerows(self.summary())
+			f.write('\n')
+			writer = csv.DictWriter(f, EVENT_FIELDS, lineterminator='\n')
+			writer.writeheader()
+			writer.writerows(events)
+
+	def print_summary(self):
+		totals = self.totals()
+		print('\n>>> Profile <<<')
+		print('Wall: {wall:.3f} sec  serial write: {write:.3f} sec  '
+				'waiting for responses: {wait:.3f} sec  other: {other:.3f} sec'.format(**totals))
+		print('{:<16}{:<7}{:>7}{:>11}{:>11}{:>11}'.format('phase', 'op', 'count', 'total', 'mean', 'max'))
+		for row in self.summary():
+			print('{:<16}{:<7}{:>7}{:>11.4f}{:>11.4f}{:>11.4f}'.format(
+					row['phase'], row['op'], row['count'], row['total'], row['mean'], row['max']))
+
+
+class NullProfiler(object):
+	"""Stands in for PhaseProfiler when --profile is not given."""
+	@contextmanager
+	def phase(self, name, index=None, port=None):
+		yield
+
+	def record(self, op, start, nbytes=0, port=None, phase=None, index=None):
+		pass
+
+	def current(self):
+		return (None, None)
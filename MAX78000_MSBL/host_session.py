@@ -0,0 +1,555 @@
+#!/usr/bin/python
+
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+# asyncio session API for the host protocol. One event loop drives the
+# non-blocking serial ports of many flash sessions from a single thread.
+# Needs Python 3.7 or newer and a POSIX system, the port file descriptors are
+# watched with loop.add_reader.
+
+import os
+import sys
+import time
+import hashlib
+import asyncio
+import argparse
+import serial
+from colorama import Fore, init
+from host_link import LineBuffer, Response, parse_reply, parse_baudrates, expand_ports
+from host_link import LinkSettings, baudrate_order, record_baudrate
+from host_link import DEFAULT_BAUDRATES, FALLBACK_BAUDRATE, BL_READY_CMD, HOST_READY_CMD
+from host_transport import create_port, is_network
+from maxim_bootloader import FlashLedger, ImageError, parse_key_file, open_image, erase_timeout
+from maxim_bootloader import ERR_KEY_EXIST, port_output
+from maxim_bootloader import bl_config_commands, ERR_TRY_AGAIN, normalize_config, config_differences
+
+VERSION = "0.1"
+ERR_TIMEOUT = -1
+
+
+class AsyncLink(object):
+	"""Serial port whose reads and writes are driven by the event loop.
+
+	pyserial only opens and configures the port, data moves through the
+	non-blocking file descriptor: a reader callback drains everything the
+	driver holds into a LineBuffer, writes wait for the descriptor to become
+	writable when the driver buffer is full.
+	"""
+	def __init__(self, port, baudrate=FALLBACK_BAUDRATE):
+		self.ser = create_port(port)
+		self.ser.baudrate = baudrate
+		self.ser.timeout = 0
+		self.lines = LineBuffer()
+		self.error = None
+		self.loop = None
+		self.fd = None
+		self.data_ready = None
+
+	def open(self):
+		self.loop = asyncio.get_running_loop()
+		self.data_ready = asyncio.Event()
+		self.ser.open()
+		self.fd = self.ser.fileno()
+		os.set_blocking(self.fd, False)
+		self.loop.add_reader(self.fd, self.on_readable)
+
+	def on_readable(self):
+		try:
+			data = os.read(self.fd, 1 << 16)
+		except BlockingIOError:
+			return
+		except OSError as e:
+			data = b''
+			self.error = e
+		if not data:
+			# the other side hung up, stop watching the descriptor
+			if self.error is None:
+				self.error = EOFError('port closed')
+			self.loop.remove_reader(self.fd)
+		else:
+			self.lines.feed(data)
+		self.data_ready.set()
+
+	async def read_line(self):
+		while True:
+			line = self.lines.next_line()
+			if line is not None:
+				return line
+			if self.error is not None:
+				raise IOError(str(self.error))
+			self.data_ready.clear()
+			await self.data_ready.wait()
+
+	async def write(self, data):
+		view = memoryview(data)
+		while view:
+			try:
+				view = view[os.write(self.fd, view):]
+			except BlockingIOError:
+				await self.writable()
+
+	async def writable(self):
+		ready = self.loop.create_future()
+		self.loop.add_writer(self.fd, lambda: ready.done() or ready.set_result(None))
+		try:
+			await ready
+		finally:
+			self.loop.remove_writer(self.fd)
+
+	def set_baudrate(self, rate):
+		self.ser.baudrate = rate
+
+	def discard_input(self):
+		self.ser.reset_input_buffer()
+		self.lines.clear()
+
+	def close(self):
+		if self.fd is not None:
+			self.loop.remove_reader(self.fd)
+			self.fd = None
+		self.ser.close()
+
+
+class BootloaderSession(object):
+	"""One host and bootloader on one port, driven by coroutines.
+
+	Covers the command set of MaximBootloader and the configuration setters
+	of MaximBootloaderConfigurator. Every reply is awaited with a timeout,
+	a reply that does not arrive in time gives err -1 like the blocking tools
+	do. Cancelling the task running a session stops it at the next await,
+	close() releases the port. Messages go to output(message, color) like
+	MaximBootloader's, nothing is printed without one.
+	"""
+	def __init__(self, port, send_size=None, window=1, baudrates=None, timeout=10.0, verbose=False,
+					erase_timeout=None, output=None):
+		self.port = port
+		self.link = AsyncLink(port)
+		self.send_size = send_size
+		self.window = window
+		self.baudrates = baudrates
+		self.timeout = timeout
+		self.verbose = verbose
+		self.erase_timeout = erase_timeout
+		self.output = output
+		self.usn = None
+		self.key_digest = None
+
+	def log(self, message, color=''):
+		if self.output is not None:
+			self.output(message, color)
+
+	async def open(self):
+		self.link.open()
+		rate = await self.negotiate_link()
+		if is_network(self.link.ser):
+			pass
+		elif rate is None:
+			self.log('Host did not answer the baud rate probe, using ' + str(FALLBACK_BAUDRATE), Fore.YELLOW)
+		elif self.verbose:
+			self.log('Link speed: ' + str(rate) + ' baud')
+		return rate
+
+	async def close(self):
+		self.link.close()
+
+	async def probe(self, timeout=0.5, rounds=2):
+		self.link.discard_input()
+		for _ in range(rounds):
+			ret = await self.send_str_cmd(HOST_READY_CMD, timeout)
+			if ret[0] == ERR_TIMEOUT:
+				return False
+		return True
+
+	async def negotiate_link(self, candidates=None):
+		"""Same policy as host_link.negotiate_baudrate, without blocking the loop."""
+		if is_network(self.link.ser):
+			return None
+		settings = LinkSettings()
+		entry = settings.get(self.port)
+		failed = list(entry.get('failed', []))
+		chosen = None
+		for rate in baudrate_order(candidates or self.baudrates or DEFAULT_BAUDRATES, entry):
+			self.link.set_baudrate(rate)
+			if await self.probe():
+				chosen = rate
+				break
+			if rate not in failed:
+				failed.append(rate)
+		if chosen is None:
+			self.link.set_baudrate(FALLBACK_BAUDRATE)
+		self.link.discard_input()
+		record_baudrate(settings, self.port, entry, chosen, failed)
+		return chosen
+
+	######### Protocol #########
+	async def read_response(self, timeout=None):
+		try:
+			return await asyncio.wait_for(self.read_reply(), timeout or self.timeout)
+		except asyncio.TimeoutError:
+			return Response(ERR_TIMEOUT, {})
+		except IOError:
+			return Response(ERR_TIMEOUT, {})
+
+	async def read_reply(self):
+		while True:
+			response = parse_reply(await self.link.read_line())
+			if response is not None:
+				return response
+
+	async def send_str_cmd(self, cmd, timeout=None):
+		if self.verbose:
+			self.log(cmd.strip())
+		await self.link.write(cmd.encode())
+		return await self.read_response(timeout)
+
+	async def wait_until_ready(self, timeout, cmd=BL_READY_CMD, interval=0.02):
+		deadline = time.time() + timeout
+		while True:
+			ret = await self.send_str_cmd(cmd)
+			if ret[0] == 0 or time.time() >= deadline:
+				return ret[0]
+			await asyncio.sleep(interval)
+
+	######### Host #########
+	async def set_host_mcu(self, ebl_mode, delay_factor, comm_interface=None):
+		if comm_interface is not None:
+			ret = await self.send_str_cmd('set_cfg comm ' + str(comm_interface) + '\n')
+			if ret[0] != 0:
+				return ret[0]
+		for cmd in ('silent_mode 1\n', 'set_cfg host ebl ' + str(ebl_mode) + '\n',
+					'set_cfg host cdf ' + str(delay_factor) + '\n'):
+			ret = await self.send_str_cmd(cmd)
+			if ret[0] != 0:
+				return ret[0]
+		return 0
+
+	async def set_send_size(self, send_size):
+		return (await self.send_str_cmd('set_partial_size ' + str(send_size) + '\n'))[0]
+
+	######### Bootloader #########
+	async def enter_bootloader_mode(self):
+		return (await self.send_str_cmd('bootldr\n'))[0]
+
+	async def get_device_info(self):
+		return await self.send_str_cmd('get_device_info\n')
+
+	async def get_usn(self):
+		ret = await self.send_str_cmd('get_usn\n')
+		if ret[0] == 0:
+			self.usn = ret[1]['value'].strip()
+		return ret[0]
+
+	async def load_key(self, key_file):
+		ret = await self.enter_bootloader_mode()
+		if ret != 0:
+			return ret
+		key_arg = parse_key_file(key_file)
+		ret = await self.send_str_cmd('set_key ' + key_arg + '\n')
+		if ret[0] == 0:
+			self.key_digest = hashlib.sha256(key_arg.encode('ascii')).hexdigest()
+		elif ret[0] == ERR_KEY_EXIST:
+			# an image encrypted with another key fails authentication
+			self.log('A key is already loaded, the image must be encrypted with it', Fore.YELLOW)
+			return 0
+		return ret[0]
+
+	async def erase_app(self, num_pages=0):
+		ret = await self.send_str_cmd('erase\n')
+		if ret[0] != 0:
+			return ret[0]
+		return await self.wait_until_ready(erase_timeout(num_pages, self.erase_timeout))
+
+	async def send_page(self, page_bin):
+		step = self.send_size
+		if step is None or step >= len(page_bin):
+			await self.link.write(page_bin)
+			return
+		for i in range(0, len(page_bin), step):
+			await self.link.write(page_bin[i: i + step])
+
+	async def download_page(self, page_bin):
+		await self.send_page(page_bin)
+		return (await self.read_response())[0]
+
+	async def download_pages(self, image, num_pages):
+		# the same window as MaximBootloader.download_pages
+		pages = image.iter_pages()
+		sent = 0
+		for i in range(num_pages):
+			while sent < num_pages and sent - i < self.window:
+				await self.send_page(next(pages))
+				sent = sent + 1
+			ret = await self.read_response()
+			if ret[0] != 0:
+				self.log('Page ' + str(i + 1) + '/' + str(num_pages) + ' failed. err: ' + str(ret[0]), Fore.RED)
+				return ret[0]
+		return 0
+
+	async def enable_image_on_RAM(self, enable):
+		return (await self.send_str_cmd('image_on_ram ' + str(int(enable == True)) + '\n'))[0]
+
+	async def flash_image_on_RAM(self, num_pages):
+		ret = await self.send_str_cmd('image_flash\n')
+		# one status line per page follows the reply to image_flash
+		for i in range(num_pages):
+			if ret[0] != 0:
+				break
+			ret = await self.read_response()
+		return ret[0]
+
+	async def exit_from_bootloader(self, num_pages):
+		await self.wait_until_ready(max(0.5, 0.03 * num_pages))
+		return (await self.send_str_cmd('exit\n'))[0]
+
+	async def restart_device(self):
+		return (await self.send_str_cmd('reset\n'))[0]
+
+	async def flash(self, image, reset=False, skip_same=False, force=False):
+		"""Single target download of image, see bootloader_single_download.
+
+		The flash ledger is only read and written with skip_same, force
+		flashes a device the ledger shows already holds the image.
+		"""
+		num_pages = image.header.numPages
+		steps = [('Entering bootloader mode', self.enter_bootloader_mode),
+				('Disabling image_on_RAM', lambda: self.enable_image_on_RAM(False)),
+				('Reading USN', self.get_usn)]
+		for label, step in steps:
+			ret = await step()
+			if ret != 0:
+				self.log(label + ' failed. err: ' + str(ret), Fore.RED)
+				return False
+
+		ledger = FlashLedger() if skip_same else None
+		if ledger is not None and not force and ledger.matches(self.usn, image.digest(), self.key_digest):
+			self.log('Device ' + self.usn + ' already holds this image, skipping download')
+		else:
+			if ledger is not None and ledger.get(self.usn):
+				ledger.update(self.usn, image=None)
+			nonce = ''.join('{:02X}'.format(c) for c in image.header.nonce)
+			auth = ''.join('{:02X}'.format(c) for c in image.header.auth)
+			cmds = ['num_pages ' + str(num_pages) + '\n', 'set_iv ' + nonce + '\n',
+					'set_auth ' + auth + '\n']
+			if self.send_size is not None:
+				cmds.append('set_partial_size ' + str(self.send_size) + '\n')
+			for cmd in cmds:
+				ret = await self.send_str_cmd(cmd)
+				if ret[0] != 0:
+					self.log(cmd.split()[0] + ' failed. err: ' + str(ret[0]), Fore.RED)
+					return False
+			if await self.erase_app(num_pages) != 0:
+				self.log('Erasing app memory failed', Fore.RED)
+				return False
+			if (await self.send_str_cmd('flash\n'))[0] != 0:
+				self.log('Entering flash mode failed', Fore.RED)
+				return False
+			if await self.download_pages(image, num_pages) != 0:
+				return False
+			if ledger is not None and not ledger.record(self.usn, image.digest(), self.key_digest,
+						image.file_name):
+				self.log('Unable to save ' + ledger.file_name, Fore.YELLOW)
+
+		if reset:
+			ret = await self.restart_device()
+		else:
+			ret = await self.exit_from_bootloader(num_pages)
+		if ret != 0:
+			self.log('Leaving bootloader failed. err: ' + str(ret), Fore.RED)
+			return False
+		return True
+
+	######### Bootloader configuration #########
+	async def set_config(self, key, value):
+		"""Sets one [BootConfig] key of a bootloader configuration file."""
+		for cfg_key, command, _ in bl_config_commands:
+			if cfg_key == key:
+				break
+		else:
+			raise KeyError('unknown bootloader setting: ' + key)
+		cmd = 'set_cfg bl ' + command + ' ' + str(value) + '\n'
+		ret = await self.send_str_cmd(cmd)
+		if ret[0] == ERR_TRY_AGAIN:
+			await self.wait_until_ready(0.6)
+			ret = await self.send_str_cmd(cmd)
+		return ret[0]
+
+	async def save_config(self):
+		ret = await self.send_str_cmd('set_cfg bl save\n')
+		if ret[0] == ERR_TRY_AGAIN:
+			await self.wait_until_ready(0.6)
+			ret = await self.send_str_cmd('set_cfg bl save\n')
+		if ret[0] == 0:
+			return await self.wait_until_ready(0.6)
+		return ret[0]
+
+	async def get_config(self):
+		return await self.send_str_cmd('get_cfg bl\n')
+
+	async def configure(self, settings):
+		"""Applies a {key: value} dict of [BootConfig] settings and saves them.
+
+		Only the settings the bootloader does not already have are sent, and
+		nothing is saved when it has all of them.
+		"""
+		ret = await self.get_device_info()
+		if ret[0] != 0:
+			return ret[0]
+		bl_version = ret[1].get('hub_firm_ver')
+		ret = await self.get_config()
+		if ret[0] != 0:
+			return ret[0]
+		current = normalize_config(ret[1], bl_version)
+		changed = [key for key, _, _ in config_differences(settings, current, bl_version)]
+		if not changed:
+			return 0
+		for key in changed:
+			value = settings[key]
+			ret = await self.set_config(key, value)
+			if ret != 0:
+				self.log(key + ' configuration failed. err: ' + str(ret), Fore.RED)
+				return ret
+		return await self.save_config()
+
+
+async def flash_session(port, image, args, ebl_mode):
+	session = BootloaderSession(port, send_size=args.send_size, window=args.window,
+								baudrates=args.baudrates, timeout=args.timeout,
+								erase_timeout=args.erase_timeout, output=port_output(port))
+	try:
+		await session.open()
+		if await session.set_host_mcu(ebl_mode, args.delay_factor, args.comm_interface) != 0:
+			session.log('Unable to set host', Fore.RED)
+			return False
+		if args.key_file is not None:
+			ret = await session.load_key(args.key_file)
+			if ret != 0:
+				session.log('Key load FAILED. err: ' + str(ret), Fore.RED)
+				return False
+		return await session.flash(image, args.reset, args.skip_same, args.force)
+	finally:
+		await session.close()
+
+
+async def flash_ports(ports, image, args, ebl_mode):
+	"""Flashes image to all ports concurrently, returns {port: (ok, seconds)}."""
+	results = {}
+
+	async def run(port):
+		start = time.time()
+		try:
+			ok = await asyncio.wait_for(flash_session(port, image, args, ebl_mode), args.session_timeout)
+		except asyncio.TimeoutError:
+			print(Fore.RED + port + ': timed out after ' + str(args.session_timeout) + ' sec')
+			ok = False
+		except (IOError, OSError, ValueError, serial.SerialException) as e:
+			print(Fore.RED + port + ': ' + str(e))
+			ok = False
+		results[port] = (ok, time.time() - start)
+
+	await asyncio.gather(*[run(port) for port in ports])
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("-f", "--input_file", type=str, required=True,
+					help="msbl or binary file as input")
+	parser.add_argument("-p", "--port", required=True, type=str,
+					help="Comma separated serial ports or a glob such as /dev/ttyACM*")
+	parser.add_argument("-k", "--key_file", type=str,
+					help="key file as input (Only available for MAX78000)")
+	parser.add_argument("-r", "--reset", action='store_true',
+					help="Reset target when flashing is done instead of jumping to the application")
+	parser.add_argument("-e", "--ebl_mode", action='store_true',
+					help="Use GPIO instead of timeout to put devices into bootloader mode")
+	parser.add_argument("-d", "--delay_factor", type=int, choices=range(0, 51), metavar="[0-50]",
+					help="Communication wait time factor. Default value is 1.", default=1)
+	parser.add_argument("-c", "--comm_interface", type=str, choices=['i2c', 'spi', 'uart'],
+					metavar="uart", help="Communication Interface selection for host and device.")
+	parser.add_argument("-s", "--send_size", type=int, choices=range(1, 8209), metavar="[1-8208]",
+					help="Partial page send size from host to bootloader.")
+	parser.add_argument("-w", "--window", type=int, choices=range(1, 9), metavar="[1-8]",
+					help="Number of pages sent ahead of their acknowledgement. Default value is 1.",
+					default=1)
+	parser.add_argument("-b", "--baudrates", type=parse_baudrates, metavar="921600,115200",
+					help="Comma separated baud rates to probe.")
+	parser.add_argument("--skip_same", action='store_true',
+					help="Skip devices the flash ledger shows already hold the image.")
+	parser.add_argument("--force", action='store_true',
+					help="Flash even if --skip_same finds the image already on the device.")
+	parser.add_argument("--timeout", type=float, default=10.0,
+					help="Seconds to wait for each reply. Default value is 10.")
+	parser.add_argument("--erase_timeout", type=float, metavar="SECONDS",
+					help="Longest wait for the bootloader after erase. Default is 2 sec, or 0.1 sec "
+					"per page of larger images.")
+	parser.add_argument("--session_timeout", type=float, default=600.0,
+					help="Seconds after which a port's session is cancelled. Default value is 600.")
+	parser.add_argument('--version', action='version', version='%(prog)s ' + VERSION)
+	args = parser.parse_args()
+	init(autoreset=True)
+
+	ports = expand_ports(args.port)
+	if len(ports) == 0:
+		print(Fore.RED + 'No serial port matches ' + args.port)
+		sys.exit(-1)
+
+	try:
+		image = open_image(args.input_file)
+	except ImageError as e:
+		print(Fore.RED + 'Reading input file failed: ' + str(e))
+		sys.exit(-1)
+
+	start = time.time()
+	try:
+		results = asyncio.run(flash_ports(ports, image, args, int(args.ebl_mode)))
+	except KeyboardInterrupt:
+		sys.exit(-1)
+	elapsed = time.time() - start
+
+	passed = 0
+	print(Fore.CYAN + '\n>>> Results <<<')
+	for port in ports:
+		ok, seconds = results.get(port, (False, 0.0))
+		if ok:
+			passed = passed + 1
+			print(Fore.GREEN + port + ': PASS in ' + '{:.1f}'.format(seconds) + ' sec')
+		else:
+			print(Fore.RED + port + ': FAIL after ' + '{:.1f}'.format(seconds) + ' sec')
+	print('Passed: ' + str(passed) + '/' + str(len(ports))
+			+ '  Total time: ' + '{:.1f}'.format(elapsed) + ' sec'
+			+ '  Boards per minute: ' + '{:.1f}'.format(passed * 60.0 / elapsed))
+	sys.exit(0 if passed == len(ports) else -1)
+
+if __name__ == '__main__':
+	main()
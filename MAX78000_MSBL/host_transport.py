@@ -0,0 +1,201 @@
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+
+# Transports the tools can talk to a host through. A port name is either a
+# local serial device, a tcp://host:port URL of a serial-to-TCP bridge (for
+# example ser2net in raw mode) or any URL pyserial understands, such as
+# rfc2217://host:port.
+
+from __future__ import print_function
+import re
+import time
+import errno
+import select
+import socket
+import serial
+
+TCP_BUFFER_SIZE = 1 << 20
+TCP_CONNECT_TIMEOUT = 5.0
+
+_tcp_url = re.compile(r'^tcp://(\[[^\]]+\]|[^:/]+):(\d+)/?$')
+
+
+def is_url(port):
+	return port is not None and '://' in port
+
+
+def create_port(port):
+	"""Returns an unopened serial-like object for a port name or URL.
+
+	Callers set baudrate and timeout and then call open(), as with
+	serial.Serial.
+	"""
+	if port is not None and port.startswith('tcp://'):
+		return TcpPort(port)
+	if is_url(port):
+		return serial.serial_for_url(port, do_not_open=True)
+	ser = serial.Serial()
+	ser.port = port
+	return ser
+
+
+def is_network(ser):
+	"""True for transports whose line speed is set by a remote bridge."""
+	if getattr(ser, 'network', False):
+		return True
+	return is_url(ser.port) and not ser.port.startswith('rfc2217://')
+
+
+class TcpPort(object):
+	"""Serial port API over a TCP connection to a serial bridge.
+
+	Implements the part of serial.Serial the tools use. Nagle's algorithm is
+	disabled so a short command goes out at once instead of waiting for the
+	previous reply's ack, and the socket buffers are enlarged so a window of
+	pages fits in flight. The baud rate is that of the bridge, setting it
+	here has no effect.
+	"""
+	network = True
+
+	def __init__(self, url):
+		match = _tcp_url.match(url)
+		if match is None:
+			raise ValueError('expected tcp://host:port, got ' + url)
+		self.port = url
+		self.name = url
+		self.host = match.group(1).strip('[]')
+		self.tcp_port = int(match.group(2))
+		self.baudrate = None
+		self.timeout = None
+		self.sock = None
+		self.rx = bytearray()
+
+	def open(self):
+		try:
+			self.sock = socket.create_connection((self.host, self.tcp_port), TCP_CONNECT_TIMEOUT)
+		except (socket.error, socket.timeout) as e:
+			raise serial.SerialException('could not connect to ' + self.port + ': ' + str(e))
+		self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+		for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+			try:
+				self.sock.setsockopt(socket.SOL_SOCKET, option, TCP_BUFFER_SIZE)
+			except socket.error:
+				pass
+		self.sock.settimeout(None)
+
+	def isOpen(self):
+		return self.sock is not None
+
+	is_open = property(isOpen)
+
+	def fileno(self):
+		return self.sock.fileno()
+
+	def receive(self, timeout):
+		"""Appends what arrives within timeout to rx, False on timeout."""
+		readable = select.select([self.sock], [], [], timeout)[0]
+		if not readable:
+			return False
+		try:
+			data = self.sock.recv(1 << 16)
+		except socket.error as e:
+			if e.args and e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+				return True
+			raise serial.SerialException(str(e))
+		if not data:
+			raise serial.SerialException('connection closed by ' + self.port)
+		self.rx += data
+		return True
+
+	@property
+	def in_waiting(self):
+		while self.receive(0):
+			pass
+		return len(self.rx)
+
+	def inWaiting(self):
+		return self.in_waiting
+
+	def read(self, size=1):
+		deadline = None
+		if self.timeout is not None:
+			deadline = time.time() + self.timeout
+		while len(self.rx) < size:
+			remaining = None
+			if deadline is not None:
+				remaining = max(0, deadline - time.time())
+			if not self.receive(remaining) and deadline is not None and time.time() >= deadline:
+				break
+		data = bytes(self.rx[:size])
+		del self.rx[:size]
+		return data
+
+	def readline(self):
+		deadline = None
+		if self.timeout is not None:
+			deadline = time.time() + self.timeout
+		while True:
+			end = self.rx.find(b'\n')
+			if end >= 0:
+				line = bytes(self.rx[:end + 1])
+				del self.rx[:end + 1]
+				return line
+			remaining = None
+			if deadline is not None:
+				remaining = max(0, deadline - time.time())
+			if not self.receive(remaining) and deadline is not None and time.time() >= deadline:
+				line = bytes(self.rx)
+				del self.rx[:]
+				return line
+
+	def write(self, data):
+		try:
+			self.sock.sendall(data)
+		except socket.error as e:
+			raise serial.SerialException(str(e))
+		return len(data)
+
+	def flush(self):
+		pass
+
+	def reset_input_buffer(self):
+		while self.receive(0):
+			pass
+		del self.rx[:]
+
+	def close(self):
+		if self.sock is not None:
+			self.sock.close()
+			self.sock = None
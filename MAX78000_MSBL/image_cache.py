@@ -0,0 +1,185 @@
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+
+# Content addressed cache of prepared images. Images are keyed by the sha256
+# of their content; an index from path, size, modification time and cache
+# format to the digest makes a repeated lookup of an unchanged file a single
+# stat.
+
+from __future__ import print_function
+import os
+import json
+import zlib
+import struct
+import binascii
+from host_link import STATE_DIR, StateFile, replace_file
+
+CACHE_DIR = os.path.join(STATE_DIR, 'image_cache')
+DEFAULT_CACHE_SIZE = 64 << 20
+# bumped whenever the conversion of a .bin file to its page stream changes,
+# so streams built by an older downloader are never served
+CACHE_FORMAT = 2
+
+
+class ImageCache(object):
+	"""Converted .bin images under a size limit, least recently used first out.
+
+	Each entry is <digest>.json with the cache format, header, page offsets
+	and page CRC32s of the image, and <digest>.msbl holding the header, the
+	sealed pages and the file CRC32, so it can be mapped like any msbl file.
+	A lookup checks only the entry format and the size and header of the
+	stored stream, its pages are checked against their CRC32s as they are
+	sent; a broken or outdated entry is dropped and rebuilt. The
+	modification time of the .json file is the last use.
+	"""
+	def __init__(self, directory=None, max_bytes=DEFAULT_CACHE_SIZE):
+		self.directory = directory if directory is not None else CACHE_DIR
+		self.max_bytes = max_bytes
+		self.index = StateFile(os.path.join(self.directory, 'index.json'))
+
+	@staticmethod
+	def stat_key(file_name):
+		st = os.stat(file_name)
+		return '%s|%d|%d|%d' % (os.path.abspath(file_name), st.st_size, int(st.st_mtime * 1e9),
+					CACHE_FORMAT)
+
+	def entry_path(self, digest, extension):
+		return os.path.join(self.directory, digest + extension)
+
+	def lookup(self, file_name):
+		"""Returns the entry of an unchanged file, or None."""
+		try:
+			digest = self.index.get(self.stat_key(file_name)).get('digest')
+		except OSError:
+			return None
+		if digest is None:
+			return None
+		try:
+			with open(self.entry_path(digest, '.json'), 'r') as f:
+				entry = json.load(f)
+			if not self.check(entry):
+				raise ValueError('cache entry does not match ' + file_name)
+		except (IOError, OSError, ValueError, KeyError, TypeError):
+			self.remove(digest)
+			return None
+		try:
+			os.utime(self.entry_path(digest, '.json'), None)
+		except OSError:
+			pass
+		entry['source'] = file_name
+		return entry
+
+	def check(self, entry):
+		if entry.get('format') != CACHE_FORMAT:
+			return False
+		header = bytearray(binascii.unhexlify(entry['header']))
+		path = self.entry_path(entry['digest'], '.msbl')
+		entry['path'] = path
+		if os.path.getsize(path) != entry['blob_size'] or len(entry['page_crcs']) != entry['num_pages']:
+			return False
+		with open(path, 'rb') as f:
+			return bytearray(f.read(len(header))) == header
+
+	def store(self, file_name, image):
+		"""Adds a .bin image, converted to a stream of sealed pages."""
+		digest = image.digest()
+		if not os.path.isdir(self.directory):
+			os.makedirs(self.directory)
+		header = bytearray(image.header)
+		entry = {'format': CACHE_FORMAT, 'digest': digest, 'size': os.path.getsize(file_name),
+					'header': binascii.hexlify(bytes(header)).decode('ascii'),
+					'num_pages': image.header.numPages}
+		offsets = []
+		crcs = []
+		offset = len(header)
+		tmp_name = self.entry_path(digest, '.msbl.tmp')
+		with open(tmp_name, 'wb') as f:
+			f.write(header)
+			crc = zlib.crc32(bytes(header))
+			for page in image.iter_pages():
+				f.write(page)
+				crc = zlib.crc32(bytes(page), crc)
+				offsets.append(offset)
+				crcs.append(zlib.crc32(bytes(page)) & 0xFFFFFFFF)
+				offset = offset + len(page)
+			f.write(struct.pack('<I', crc & 0xFFFFFFFF))
+		replace_file(tmp_name, self.entry_path(digest, '.msbl'))
+		entry['blob'] = digest + '.msbl'
+		entry['blob_size'] = offset + 4
+		entry['page_offsets'] = offsets
+		entry['page_crcs'] = crcs
+		tmp_name = self.entry_path(digest, '.json.tmp')
+		with open(tmp_name, 'w') as f:
+			json.dump(entry, f)
+		replace_file(tmp_name, self.entry_path(digest, '.json'))
+		# earlier versions of the same file, or of the cache format, are no
+		# longer reachable
+		key = self.stat_key(file_name)
+		path = os.path.abspath(file_name) + '|'
+		self.index.remove(*[item for item in self.index.load() if item.startswith(path) and item != key])
+		self.index.update(key, digest=digest)
+		self.evict()
+
+	def remove(self, digest):
+		for extension in ('.json', '.msbl'):
+			try:
+				os.remove(self.entry_path(digest, extension))
+			except OSError:
+				pass
+
+	def evict(self):
+		entries = []
+		total = 0
+		for name in os.listdir(self.directory):
+			if not name.endswith('.json') or name == 'index.json':
+				continue
+			digest = name[:-len('.json')]
+			size = 0
+			for extension in ('.json', '.msbl'):
+				try:
+					size = size + os.path.getsize(self.entry_path(digest, extension))
+				except OSError:
+					pass
+			entries.append((os.path.getmtime(self.entry_path(digest, '.json')), digest, size))
+			total = total + size
+		entries.sort()
+		evicted = set()
+		while total > self.max_bytes and entries:
+			_, digest, size = entries.pop(0)
+			self.remove(digest)
+			evicted.add(digest)
+			total = total - size
+		if evicted:
+			self.index.remove(*[key for key, value in self.index.load().items()
+								if value.get('digest') in evicted])
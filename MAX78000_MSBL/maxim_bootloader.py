@@ -0,0 +1,1958 @@
+################################################################################
+# Copyright (C) 2018 Maxim Integrated Products, Inc., All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+# IN NO EVENT SHALL MAXIM INTEGRATED BE LIABLE FOR ANY CLAIM, DAMAGES
+# OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
+# ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+# OTHER DEALINGS IN THE SOFTWARE.
+#
+# Except as contained in this notice, the name of Maxim Integrated
+# Products, Inc. shall not be used except as stated in the Maxim Integrated
+# Products, Inc. Branding Policy.
+#
+# The mere transfer of this software does not imply any licenses
+# of trade secrets, proprietary technology, copyrights, patents,
+# trademarks, maskwork rights, or any other form of intellectual
+# property whatsoever. Maxim Integrated Products, Inc. retains all
+# ownership rights.
+#
+###############################################################################
+
+
+# Flashing library behind download_fw_over_host.py and configure_bootloader.py:
+# msbl and bin images, the bootloader session, the bootloader configuration
+# and progress reporting. Nothing here prints or exits; messages go to an
+# optional output callback, page transfers to an optional progress callback,
+# and failed steps raise BootloaderError.
+
+from __future__ import print_function
+import os
+import sys
+import time
+import zlib
+import mmap
+import bisect
+import struct
+import hashlib
+import binascii
+import threading
+import re
+import serial
+try:
+	import ConfigParser
+except ImportError:
+	import configparser as ConfigParser
+from ctypes import Structure, sizeof, c_char, c_ubyte, c_ushort, c_uint
+from threading import Thread
+from datetime import datetime
+from colorama import Fore
+from host_link import negotiate_baudrate, fall_back_baudrate, wait_until_ready
+from host_link import HOST_READY_CMD, ResponseReader, StateLog
+from host_transport import create_port, is_network
+from host_profile import NullProfiler
+
+platform_types = { 1: 'MAX32660',
+                   3: 'MAX32670',
+                   5: 'MAX78000',}
+
+DEFAULT_PAGE_SIZE = 8192
+# page data, CRC32 and padding as sent to the host
+PAGE_LENGTH = DEFAULT_PAGE_SIZE + 16
+# a page of erased flash
+BLANK_PAGE = b'\xff' * DEFAULT_PAGE_SIZE
+# erase waits at least ERASE_TIMEOUT seconds, longer for large images; the user
+# guide gives 40 ms per page, the margin costs nothing as the wait ends early
+ERASE_TIMEOUT = 2.0
+ERASE_PAGE_TIMEOUT = 0.1
+
+# set_key refused: a key is loaded already and cannot be replaced
+ERR_KEY_EXIST = 0x86
+
+# --tune candidates: the whole page first, then halves, thirds and sixths of it.
+# The sweep starts from the longest delay, so the interface is found even on a
+# board that needs long waits.
+TUNE_INTERFACES = ['i2c', 'spi', 'uart']
+TUNE_DELAY_FACTORS = [0, 1, 2, 5, 10]
+TUNE_SEND_SIZES = [PAGE_LENGTH, PAGE_LENGTH // 2, PAGE_LENGTH // 3, PAGE_LENGTH // 6]
+TUNE_START = {'comm_interface': 'i2c', 'delay_factor': TUNE_DELAY_FACTORS[-1], 'send_size': PAGE_LENGTH}
+# a candidate must be this much faster to replace an earlier one, timing noise is not a gain
+TUNE_MARGIN = 1.03
+# pages each trial flashes, enough to time the link without wearing a big image's flash
+TUNE_PAGES = 16
+
+class MsblHeader(Structure):
+	_fields_ = [('magic', 4 * c_char),
+				('formatVersion', c_uint),
+				('target', 16 * c_char),
+				('enc_type', 16 * c_char),
+				('nonce', 11 * c_ubyte),
+				('resv0', c_ubyte),
+				('auth', 16 * c_ubyte),
+				('numPages', c_ushort),
+				('pageSize', c_ushort),
+				('crcSize', c_ubyte),
+				('resv1', 3 * c_ubyte)]
+
+class Page(Structure):
+	_fields_ = [('data', PAGE_LENGTH * c_ubyte)]
+
+class CRC32(Structure):
+	_fields_ = [('val', c_uint)]
+
+class EBL_MODE:
+	USE_TIMEOUT = 0
+	USE_GPIO = 1
+
+
+class BootloaderError(Exception):
+	"""A step of the host protocol failed.
+
+	step is the command that failed, err the error code the host answered
+	with (-1 when it did not answer) and page the page that was refused,
+	each None when it does not apply.
+	"""
+	def __init__(self, message, step=None, err=None, page=None):
+		Exception.__init__(self, message)
+		self.step = step
+		self.err = err
+		self.page = page
+
+class PortError(BootloaderError):
+	"""The serial port or network bridge cannot be opened."""
+
+class ImageError(BootloaderError):
+	"""The input image cannot be read or fails its checks."""
+
+def step_error(message, step, err, page=None):
+	return BootloaderError(message + '. err: ' + str(err), step, err, page)
+
+
+# sessions on several ports share the console, a line is written in one piece
+output_lock = threading.Lock()
+
+def console_output(message, color=''):
+	"""Output callback printing to the console like the scripts always did."""
+	with output_lock:
+		print(color + message + '\n', end='')
+
+def port_output(port):
+	"""Output callback like console_output with every line prefixed by port,
+	so the output of sessions on several ports can be told apart."""
+	def output(message, color=''):
+		console_output(port + ': ' + message.lstrip('\n'), color)
+	return output
+
+
+class ProgressRenderer(object):
+	"""Progress callback drawing pages done, KB/s and time left.
+
+	Redraws at most every interval seconds, so page transfers do not wait on
+	a slow console. On a terminal the status line is redrawn in place,
+	elsewhere (log files, CI) every update is a line of its own. With a
+	prefix, ports share the console and every update is a line as well.
+	"""
+	def __init__(self, stream=None, interval=0.5, prefix=''):
+		self.stream = stream if stream is not None else sys.stdout
+		self.interval = interval
+		self.prefix = prefix
+		self.inplace = not prefix and hasattr(self.stream, 'isatty') and self.stream.isatty()
+		self.start = time.time()
+		self.last = 0
+
+	def __call__(self, label, page, num_pages, nbytes):
+		now = time.time()
+		if page == 0:
+			self.start = now
+			self.last = now
+			return
+		done = page >= num_pages
+		if not done and now - self.last < self.interval:
+			return
+		self.last = now
+		elapsed = max(now - self.start, 1e-6)
+		left = elapsed * (num_pages - page) / page
+		line = (self.prefix + label + ' ' + str(page) + '/' + str(num_pages) + ' pages  '
+				+ '{:.1f}'.format(nbytes / 1024.0 / elapsed) + ' KB/s  '
+				+ ('done in {:.1f} sec'.format(elapsed) if done else 'ETA {:.0f} sec'.format(left)))
+		with output_lock:
+			if self.inplace:
+				self.stream.write('\r' + line + ('\n' if done else ''))
+			else:
+				self.stream.write(line + '\n')
+			self.stream.flush()
+
+
+######### Images #########
+def buffer_view(data, start, size):
+	"""Zero-copy slice that zlib and serial accept on Python 2 and 3."""
+	if sys.version_info[0] < 3:
+		return buffer(data, start, size)
+	return memoryview(data)[start: start + size]
+
+class MsblPages(object):
+	"""Lazy sequence of the pages of a mapped .msbl file, one slice per page.
+
+	With crcs, each page is checked against its recorded CRC32 as it is
+	handed out, so a cached image is verified while it is sent rather than
+	in a pass of its own.
+	"""
+	def __init__(self, image, offset, count, size):
+		self.image = image
+		self.offset = offset
+		self.count = count
+		self.size = size
+		self.crcs = None
+
+	def __len__(self):
+		return self.count
+
+	def __getitem__(self, page_num):
+		if not 0 <= page_num < self.count:
+			raise IndexError('page ' + str(page_num) + ' out of range')
+		page = self.image.slice(self.offset + page_num * self.size, self.size)
+		if self.crcs is not None and zlib.crc32(page) & 0xFFFFFFFF != self.crcs[page_num]:
+			raise ImageError('Cached page ' + str(page_num + 1) + ' of ' + self.image.file_name
+					+ ' is corrupt, remove ' + self.image.cache_entry['path'])
+		return page
+
+class MsblImage(object):
+	"""Memory mapped .msbl file.
+
+	The header is decoded once, pages are handed out as views into the
+	mapping, so nothing is copied until a page is written to the port.
+	"""
+	def __init__(self, file_name):
+		self.file_name = file_name
+		self.f = open(file_name, 'rb')
+		self.mm = None
+		self.sha256 = None
+		self.cache_entry = None
+		file_size = os.fstat(self.f.fileno()).st_size
+		if file_size < sizeof(MsblHeader) + sizeof(CRC32):
+			self.close()
+			raise ValueError('File is too short for an msbl image: ' + str(file_size) + ' bytes')
+		self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+		self.header = MsblHeader.from_buffer_copy(self.mm[:sizeof(MsblHeader)])
+		self.crc32 = CRC32.from_buffer_copy(self.mm[-sizeof(CRC32):])
+		self.size = file_size
+		self.page = MsblPages(self, sizeof(MsblHeader),
+					(file_size - sizeof(MsblHeader) - sizeof(CRC32)) // sizeof(Page), sizeof(Page))
+
+	def slice(self, offset, size):
+		return buffer_view(self.mm, offset, size)
+
+	def compute_crc32(self, chunk_size=1 << 20):
+		crc = 0
+		end = self.size - sizeof(CRC32)
+		for offset in range(0, end, chunk_size):
+			crc = zlib.crc32(self.slice(offset, min(chunk_size, end - offset)), crc)
+		return crc & 0xFFFFFFFF
+
+	def verify_pages(self):
+		"""Returns the index of the first page failing its checks, None if all pass.
+
+		Pages of an unencrypted image must match the CRC32 that follows their
+		data.
+		"""
+		plaintext = len(self.header.enc_type) == 0
+		for page_num in range(self.header.numPages):
+			page = self.page[page_num]
+			if plaintext:
+				crc = zlib.crc32(buffer_view(page, 0, DEFAULT_PAGE_SIZE)) & 0xFFFFFFFF
+				if crc != struct.unpack_from('<I', page, DEFAULT_PAGE_SIZE)[0]:
+					return page_num
+		return None
+
+	def digest(self, chunk_size=1 << 20):
+		if self.sha256 is None:
+			h = hashlib.sha256()
+			for offset in range(0, self.size, chunk_size):
+				h.update(self.slice(offset, min(chunk_size, self.size - offset)))
+			self.sha256 = h.hexdigest()
+		return self.sha256
+
+	def iter_pages(self):
+		for page_num in range(self.header.numPages):
+			yield self.page[page_num]
+
+	def close(self):
+		if self.mm is not None:
+			self.mm.close()
+			self.mm = None
+		self.f.close()
+
+class BinPages(object):
+	"""Random access to the pages of a BinImage, read from the file on demand."""
+	def __init__(self, image):
+		self.image = image
+
+	def __len__(self):
+		return self.image.header.numPages
+
+	def __getitem__(self, page_num):
+		if not 0 <= page_num < len(self):
+			raise IndexError('page ' + str(page_num) + ' out of range')
+		if page_num == len(self) - 1:
+			return self.image.trailer_page()
+		page = bytearray(sizeof(Page))
+		with self.image.lock:
+			self.image.f.seek(page_num * DEFAULT_PAGE_SIZE)
+			self.image.f.readinto(memoryview(page)[:DEFAULT_PAGE_SIZE])
+		return self.image.seal_page(page)
+
+def used_length(f, size):
+	"""Length of the first size bytes of f without their trailing blank pages.
+
+	The bootloader erases the application area before programming, so pages
+	of erased flash (0xFF) at the end of an application need not be sent.
+	Pages are compared whole, at memcmp speed, from the end until one holds
+	data; the first page is always kept.
+	"""
+	end = size
+	while end > DEFAULT_PAGE_SIZE:
+		start = (end - 1) // DEFAULT_PAGE_SIZE * DEFAULT_PAGE_SIZE
+		f.seek(start)
+		data = f.read(end - start)
+		if data != BLANK_PAGE[:len(data)]:
+			break
+		end = start
+	return end
+
+class BinImage(object):
+	"""Application .bin file presented as unencrypted msbl pages.
+
+	iter_pages reads the file once in page sized chunks and yields each page
+	with its CRC32 appended, followed by the page that carries the CRC32 and
+	length of the application. Only one page is held at a time. Blank pages
+	at the end of the file are left out: the application length and CRC32
+	cover the pages that are sent, and flash holds 0xFF after them anyway.
+	"""
+	def __init__(self, file_name):
+		self.file_name = file_name
+		self.f = open(file_name, 'rb')
+		self.lock = threading.Lock()
+		self.file_size = os.fstat(self.f.fileno()).st_size
+		self.size = used_length(self.f, self.file_size)
+		self.app_crc = None
+		self.sha256 = None
+		self.header = MsblHeader()
+		self.header.magic = b'msbl'
+		self.header.formatVersion = 0
+		self.header.target = b'MAX32660'
+		self.header.enc_type = b''
+		self.header.pageSize = DEFAULT_PAGE_SIZE
+		self.header.crcSize = 4
+		# data pages plus the application information page
+		self.header.numPages = (self.size + DEFAULT_PAGE_SIZE - 1) // DEFAULT_PAGE_SIZE + 1
+		self.page = BinPages(self)
+
+	@staticmethod
+	def seal_page(page):
+		crc = zlib.crc32(buffer_view(page, 0, DEFAULT_PAGE_SIZE)) & 0xFFFFFFFF
+		struct.pack_into('<I', page, DEFAULT_PAGE_SIZE, crc)
+		return page
+
+	def trailer_page(self):
+		if self.app_crc is None:
+			self.app_crc = self.compute_app_crc()
+		page = bytearray(sizeof(Page))
+		struct.pack_into('<II', page, 0, self.app_crc, self.size)
+		return self.seal_page(page)
+
+	def compute_app_crc(self):
+		crc = 0
+		chunk = bytearray(1 << 16)
+		left = self.size
+		with open(self.file_name, 'rb') as f:
+			while left > 0:
+				n = f.readinto(memoryview(chunk)[:min(left, len(chunk))])
+				if not n:
+					break
+				crc = zlib.crc32(buffer_view(chunk, 0, n), crc)
+				left = left - n
+		return crc & 0xFFFFFFFF
+
+	def digest(self):
+		if self.sha256 is None:
+			h = hashlib.sha256()
+			with open(self.file_name, 'rb') as f:
+				for chunk in iter(lambda: f.read(1 << 16), b''):
+					h.update(chunk)
+			self.sha256 = h.hexdigest()
+		return self.sha256
+
+	def iter_pages(self):
+		crc = 0
+		length = 0
+		with open(self.file_name, 'rb') as f:
+			for page_num in range(self.header.numPages - 1):
+				page = bytearray(sizeof(Page))
+				n = f.readinto(memoryview(page)[:min(DEFAULT_PAGE_SIZE, self.size - length)])
+				crc = zlib.crc32(buffer_view(page, 0, n), crc)
+				length = length + n
+				yield self.seal_page(page)
+		if length != self.size or os.path.getsize(self.file_name) != self.file_size:
+			raise IOError('Bin file changed while reading: ' + self.file_name)
+		self.app_crc = crc & 0xFFFFFFFF
+		yield self.trailer_page()
+
+	def close(self):
+		self.f.close()
+
+def erase_timeout(num_pages, timeout=None):
+	"""Seconds to wait for the bootloader after erase, timeout if given."""
+	if timeout is not None:
+		return timeout
+	return max(ERASE_TIMEOUT, ERASE_PAGE_TIMEOUT * num_pages)
+
+def quiet_output(message, color=''):
+	pass
+
+def as_hex(arr):
+	return ' '.join(format(i, '02x') for i in arr)
+
+def open_image(file_name, cache=None, profile=None, output=None):
+	"""Opens and verifies a .msbl or .bin file for flashing.
+
+	With an ImageCache, an unchanged .bin file is taken from its converted
+	copy and a new one is added to the cache; an msbl file is read in place
+	either way. Raises ImageError when the file cannot be flashed.
+	"""
+	if profile is None:
+		profile = NullProfiler()
+	if output is None:
+		output = quiet_output
+	extension = os.path.splitext(file_name)[1]
+	if extension not in ('.bin', '.msbl'):
+		raise ImageError('Invalid file extension: ' + extension)
+	if extension != '.bin':
+		# verify_pages reads every page of an msbl file anyway
+		cache = None
+	with profile.phase('read_file'):
+		image = None
+		if cache is not None:
+			image = read_cached_image(cache, file_name, output)
+		cached = image is not None
+		if cached:
+			pass
+		elif extension == '.bin':
+			image = read_bin_image(file_name, output)
+		else:
+			image = read_msbl_image(file_name, output)
+	with profile.phase('verify'):
+		try:
+			verify_image(image, output)
+		except ImageError:
+			image.close()
+			raise
+	if cache is not None and not cached:
+		try:
+			cache.store(file_name, image)
+		except (IOError, OSError) as e:
+			output('Unable to cache image: ' + str(e))
+	return image
+
+def read_cached_image(cache, file_name, output):
+	entry = cache.lookup(file_name)
+	if entry is None:
+		return None
+	try:
+		image = MsblImage(entry['path'])
+	except (IOError, OSError, ValueError):
+		return None
+	if image.header.numPages != entry['num_pages'] or len(image.page) < entry['num_pages']:
+		image.close()
+		return None
+	# the cached stream of a .bin input stands in for the source file
+	image.file_name = entry['source']
+	image.sha256 = entry['digest']
+	image.cache_entry = entry
+	image.page.crcs = entry['page_crcs']
+	output('Image ' + image.file_name + ' from cache, numPages: ' + str(image.header.numPages))
+	return image
+
+def read_bin_image(file_name, output):
+	output('Bin file name: ' + file_name)
+	try:
+		image = BinImage(file_name)
+	except (IOError, OSError) as e:
+		raise ImageError('Unable to read bin file: ' + str(e))
+	output('Bin file size: ' + str(image.file_size) + '  numPages: ' + str(image.header.numPages))
+	if image.size < image.file_size:
+		output('Blank pages at the end left out: '
+				+ str((image.file_size - image.size + DEFAULT_PAGE_SIZE - 1) // DEFAULT_PAGE_SIZE)
+				+ ', application length: '
+				+ str(image.size))
+	return image
+
+def read_msbl_image(file_name, output):
+	output('msbl file name: ' + file_name)
+	try:
+		image = MsblImage(file_name)
+	except (IOError, OSError, ValueError) as e:
+		raise ImageError('Unable to read msbl file: ' + str(e))
+
+	header = image.header
+	output('magic: ' + header.magic.decode('ascii', 'replace')
+			+ '  formatVersion: ' + str(header.formatVersion)
+			+ '  target: ' + header.target.decode('ascii', 'replace')
+			+ '  enc_type: ' + header.enc_type.decode('ascii', 'replace')
+			+ '  numPages: ' + str(header.numPages)
+			+ '  pageSize: ' + str(header.pageSize)
+			+ '  crcSize: ' + str(header.crcSize)
+			+ ' size of header: ' + str(sizeof(header)))
+	output('  resv0: ' + str(header.resv0))
+	output('nonce : ' + as_hex(header.nonce))
+	output('auth : ' + as_hex(header.auth))
+	output('resv1 : ' + as_hex(header.resv1))
+
+	if header.numPages > len(image.page):
+		image.close()
+		raise ImageError('msbl file holds ' + str(len(image.page)) + ' pages, header expects '
+				+ str(header.numPages))
+	output('Reading msbl file succeed.')
+	return image
+
+def verify_image(image, output):
+	if isinstance(image, BinImage):
+		# bin pages are sealed as they are read
+		return
+	if image.cache_entry is not None:
+		# cached pages are checked against their CRC32s as they are sent
+		return
+	crc32 = image.compute_crc32()
+	output('Total file size: ' + str(image.size) + ' CRC32: ' + hex(image.crc32.val))
+	if crc32 != image.crc32.val:
+		raise ImageError('msbl file CRC32 mismatch, calculated: ' + hex(crc32))
+	bad_page = image.verify_pages()
+	if bad_page is not None:
+		raise ImageError('Page ' + str(bad_page + 1) + ' of ' + image.file_name + ' is corrupt')
+	output('Image verified: ' + image.file_name)
+
+def read_key_block(keyfile, start_marker):
+	if keyfile.readline() != start_marker:
+		raise ValueError('Invalid Key file start')
+	block = ''
+	while True:
+		line = keyfile.readline()
+		if line == 'aes_key_end\n' or line == 'aes_key_end':
+			return block
+		if line == '':
+			raise ValueError('Key file ended before aes_key_end')
+		block += line.replace("0x", "").replace(",", "").replace(" ", "").replace("\n", "")
+
+def parse_key_file(key_file):
+	"""Returns the set_key argument for a key file.
+
+	The argument is the key and the AAD, each preceded by its length in
+	bytes and padded to 32 bytes, as hex.
+	"""
+	with open(key_file, 'r') as keyfile:
+		key = read_key_block(keyfile, 'aes_key_start\n')
+		aad = read_key_block(keyfile, 'aes_aad_start\n')
+	key_length = len(key) // 2
+	if key_length not in (16, 24, 32):
+		raise ValueError('Wrong Key Length')
+	aad_length = len(aad) // 2
+	if aad_length > 32:
+		raise ValueError('Wrong AAD Length')
+	try:
+		binascii.unhexlify(key + aad)
+	except (TypeError, ValueError):
+		raise ValueError('Key file holds bytes that are not hex')
+	return ('{:02x}'.format(key_length) + key + '00' * (32 - key_length)
+			+ '{:02x}'.format(aad_length) + aad + '00' * (32 - aad_length))
+
+def describe_setting(setting):
+	return ('interface ' + str(setting['comm_interface']) + ', delay factor '
+			+ str(setting['delay_factor']) + ', send size ' + str(setting['send_size']))
+
+class KeyManifest(object):
+	"""Key files assigned to devices by USN, read and validated once.
+
+	Each manifest line holds a USN, or an inclusive first-last range of
+	USNs, and the key file for it, relative to the manifest; # starts a
+	comment. Every key file is parsed when the manifest is read, so a bad
+	key stops the run before a board is touched. Single USNs are found in a
+	dict and ranges by bisecting their sorted first USNs; a single USN wins
+	over a range holding it.
+	"""
+	def __init__(self, file_name):
+		self.file_name = file_name
+		self.single = {}
+		self.firsts = []
+		self.ranges = []
+		keys = {}
+		ranges = []
+		directory = os.path.dirname(file_name)
+		with open(file_name, 'r') as f:
+			for number, line in enumerate(f, 1):
+				fields = line.split('#', 1)[0].split()
+				if not fields:
+					continue
+				where = file_name + ':' + str(number) + ': '
+				if len(fields) != 2:
+					raise ValueError(where + 'expected a USN or first-last range and a key file')
+				key_path = os.path.join(directory, fields[1])
+				if key_path not in keys:
+					try:
+						key_arg = parse_key_file(key_path)
+					except (IOError, OSError, ValueError) as e:
+						raise ValueError(where + key_path + ': ' + str(e))
+					keys[key_path] = (fields[1], key_arg)
+				first, _, last = fields[0].partition('-')
+				first = self.usn_value(first, where)
+				if not last:
+					if first in self.single:
+						raise ValueError(where + 'USN ' + fields[0] + ' is assigned twice')
+					self.single[first] = keys[key_path]
+					continue
+				last = self.usn_value(last, where)
+				if last < first:
+					raise ValueError(where + 'range ' + fields[0] + ' ends before it starts')
+				ranges.append((first, last, keys[key_path], where))
+		ranges.sort(key=lambda item: item[0])
+		for first, last, key, where in ranges:
+			if self.ranges and first <= self.ranges[-1][0]:
+				raise ValueError(where + 'range overlaps an earlier range')
+			self.firsts.append(first)
+			self.ranges.append((last, key))
+		self.key_count = len(keys)
+
+	@staticmethod
+	def usn_value(text, where=''):
+		try:
+			return int(text, 16)
+		except ValueError:
+			raise ValueError(where + 'USN ' + text + ' is not hex')
+
+	def lookup(self, usn):
+		"""Returns (key file name, set_key argument) for usn, None if none is assigned."""
+		try:
+			value = self.usn_value(usn)
+		except ValueError:
+			return None
+		if value in self.single:
+			return self.single[value]
+		index = bisect.bisect_right(self.firsts, value) - 1
+		if index >= 0 and value <= self.ranges[index][0]:
+			return self.ranges[index][1]
+		return None
+
+def read_key_manifest(file_name):
+	"""Reads a KeyManifest, raising BootloaderError if it or a key file is unusable."""
+	try:
+		return KeyManifest(file_name)
+	except (IOError, OSError, ValueError) as e:
+		raise BootloaderError('Unable to read key manifest: ' + str(e), 'set_key')
+
+class KeyLedger(StateLog):
+	"""Key file loaded into each device by a key manifest, keyed by USN."""
+	default_name = 'key_ledger.jsonl'
+	item_name = 'usn'
+
+	def record(self, usn, key_name, key_digest):
+		return self.update(usn, file=key_name, key=key_digest,
+					time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+class FlashLedger(StateLog):
+	"""Image and key last flashed to each device, keyed by USN."""
+	default_name = 'flash_ledger.jsonl'
+	item_name = 'usn'
+
+	def matches(self, usn, image_digest, key_digest):
+		entry = self.get(usn)
+		if entry.get('image') != image_digest:
+			return False
+		# a key loaded in this run must be the one the image was flashed with
+		return key_digest is None or entry.get('key') == key_digest
+
+	def record(self, usn, image_digest, key_digest, file_name):
+		return self.update(usn, image=image_digest, key=key_digest,
+					file=os.path.basename(file_name),
+					time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+
+######### Session #########
+class MaximBootloader(object):
+	"""One host and the bootloader behind it on one port.
+
+	The protocol steps return the host's error code. The operations built
+	from them (set_host_mcu, load_key, flash, load_to_RAM, flash_from_RAM,
+	leave_bootloader) raise BootloaderError when a step fails. Messages go
+	to output(message, color) and page transfers to
+	progress(label, page, num_pages, nbytes), page 0 marking the start of
+	a transfer; without callbacks the session is silent.
+	"""
+	def __init__(self, port, send_size=None, window=1, baudrates=None, skip_same=False,
+					force=False, profile=None, retries=0, output=None, progress=None,
+					erase_timeout=None):
+		self.output = output
+		self.progress = progress
+		try:
+			self.ser = create_port(port)
+		except ValueError as e:
+			raise PortError(str(e))
+		self.ser.baudrate = 115200
+		self.ser.timeout = 300
+		self.reader = ResponseReader(self.ser)
+		self.send_size = send_size
+		self.window = window
+		self.baudrates = baudrates
+		self.skip_same = skip_same
+		self.force = force
+		self.usn = None
+		self.board = None
+		self.key_digest = None
+		self.profile = profile if profile is not None else NullProfiler()
+		self.retries = retries
+		self.erase_timeout = erase_timeout
+		self.failed_page = None
+		# page errors while tuning come from the setting under test, not the link
+		self.link_fallback = True
+		self.image = None
+		self.image_thread = None
+		self.image_error = None
+		self.quit_flag = False
+		with self.phase('open'):
+			try:
+				self.ser.open()
+			except (OSError, serial.SerialException) as e:
+				raise PortError('Cannot open serial port ' + port + ': ' + str(e))
+			self.log(self.ser.name + ' is open...')
+			self.negotiate_link()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def log(self, message, color=''):
+		if self.output is not None:
+			self.output(message, color)
+
+	def report(self, label, page, num_pages, nbytes):
+		if self.progress is not None:
+			self.progress(label, page, num_pages, nbytes)
+
+	def check(self, err, message, step):
+		if err != 0:
+			raise step_error(message, step, err)
+
+	def phase(self, name, index=None):
+		return self.profile.phase(name, index, self.ser.port)
+
+	######### Image #########
+	def set_image(self, image):
+		self.image = image
+		self.image_thread = None
+		self.image_error = None
+
+	def start_image_load(self, file_name, cache=None):
+		# The image is read and verified while the port talks to the host,
+		# the download waits for it in wait_for_image.
+		def load():
+			try:
+				self.image = open_image(file_name, cache, self.profile, self.output)
+			except Exception as e:
+				self.image_error = e
+		self.image = None
+		self.image_error = None
+		self.image_thread = Thread(target=load)
+		self.image_thread.daemon = True
+		self.image_thread.start()
+
+	def wait_for_image(self):
+		if self.image_thread is not None:
+			with self.phase('wait_image'):
+				# join with a timeout so Ctrl + C still reaches the main thread
+				while self.image_thread.is_alive():
+					self.image_thread.join(0.1)
+			self.image_thread = None
+		error = self.image_error
+		if isinstance(error, BootloaderError):
+			raise error
+		if error is not None:
+			raise ImageError('Reading input file failed: ' + str(error))
+		if self.image is None:
+			raise ImageError('No image to flash')
+		return self.image
+
+	######### Link #########
+	def negotiate_link(self):
+		if is_network(self.ser):
+			self.log('Link speed is set by the bridge at ' + self.ser.port)
+			return None
+		rate = negotiate_baudrate(self.ser, self.ser.port, self.baudrates, output=self.output)
+		self.reader.clear()
+		if rate is None:
+			self.log('Host did not answer the baud rate probe, using ' + str(self.ser.baudrate), Fore.YELLOW)
+		else:
+			self.log('Link speed: ' + str(rate) + ' baud')
+		return rate
+
+	def fall_back_link(self):
+		if is_network(self.ser):
+			return False
+		rate = fall_back_baudrate(self.ser, self.baudrates)
+		self.reader.clear()
+		if rate is None:
+			self.log('No slower baud rate left to fall back to')
+			return False
+		self.log('Link errors, falling back to ' + str(rate) + ' baud', Fore.YELLOW)
+		return True
+
+	def drain_link(self, quiet=0.1, limit=2.0):
+		saved_timeout = self.ser.timeout
+		self.ser.timeout = quiet
+		deadline = time.time() + limit
+		try:
+			while self.ser.read(max(1, self.ser.in_waiting)) and time.time() < deadline:
+				pass
+		except (OSError, IOError, serial.SerialException):
+			pass
+		finally:
+			self.ser.timeout = saved_timeout
+		self.reader.clear()
+
+	def resync(self, usn, timeout=0.5, pads=3):
+		"""Brings the host back to its command prompt after a failed transfer.
+
+		The host may still be waiting for the rest of a page, so while it does
+		not answer, a page of line ends is sent to fill it up; line ends are
+		ignored once the host reads commands again. Returns True when the
+		bootloader answers and, if usn is given, it is still the same board.
+		"""
+		with self.phase('resync'):
+			saved_timeout = self.ser.timeout
+			self.ser.timeout = timeout
+			try:
+				for _ in range(pads + 1):
+					self.drain_link()
+					if wait_until_ready(self.send_str_cmd, timeout, HOST_READY_CMD) == 0:
+						break
+					self.write(b'\n' * PAGE_LENGTH)
+				else:
+					self.log('Host does not answer', Fore.RED)
+					return False
+				target = self.probe_target()
+			finally:
+				self.ser.timeout = saved_timeout
+		if target is None:
+			self.log('Bootloader does not answer', Fore.RED)
+			return False
+		if usn is not None and target != usn:
+			self.log('Board ' + target + ' answers instead of ' + usn, Fore.RED)
+			return False
+		return True
+
+	def run_with_retries(self, action, usn):
+		"""Runs action, then resyncs and reruns it until it succeeds or the
+		retry budget is spent. action returns None on success, else the
+		BootloaderError of the failed step. Returns the last failure."""
+		failure = action()
+		for attempt in range(1, self.retries + 1):
+			if failure is None:
+				break
+			label = 'Recovery ' + str(attempt) + '/' + str(self.retries)
+			self.log('\n' + label + ' (' + str(failure) + ')', Fore.YELLOW)
+			start = time.time()
+			if not self.resync(usn):
+				self.log(label + ': FAILED to resync, giving up', Fore.RED)
+				return failure
+			failure = action()
+			if failure is None:
+				self.log(label + ': SUCCEED in ' + '{:.1f}'.format(time.time() - start) + ' sec', Fore.GREEN)
+			else:
+				self.log(label + ': FAILED, ' + str(failure), Fore.RED)
+		return failure
+
+	######### Host #########
+	def set_host_mcu(self, ebl_mode, delay_factor, comm_interface=None):
+		if not EBL_MODE.USE_TIMEOUT <= ebl_mode <= EBL_MODE.USE_GPIO:
+			raise ValueError('Invalid ebl_mode: ' + str(ebl_mode))
+
+		if comm_interface is not None:
+			self.check(self.set_host_comm_interface(comm_interface),
+						'Unable to change communication medium', 'set_cfg comm')
+
+		err = self.disable_echo()
+		if err != 0 and self.fall_back_link():
+			err = self.disable_echo()
+		self.check(err, 'Unable to disable echo mode. Communication failed', 'silent_mode')
+
+		self.check(self.set_host_ebl_mode(ebl_mode), 'Unable to set EBL mode in host', 'set_cfg host ebl')
+		self.check(self.set_host_delay_factor(delay_factor),
+					'Unable to set delay factor mode in host', 'set_cfg host cdf')
+
+	def set_host_comm_interface(self, comm):
+		self.log('\nBootloader communication interface as ' + comm, Fore.GREEN)
+		ret = self.send_str_cmd('set_cfg comm ' + str(comm) + '\n')
+		self.log('Command: set_cfg comm ' + str(comm) + '\n')
+		if ret[0] == 0:
+			self.log('Set comm interface to ' + str(comm))
+		return ret[0]
+
+	def set_host_ebl_mode(self, ebl_mode):
+		self.log('\nSet timeout mode to enter bootloader', Fore.GREEN)
+		ret = self.send_str_cmd('set_cfg host ebl ' + str(ebl_mode) + '\n')
+		self.log('Command: set_cfg host ebl ' + str(ebl_mode) + '\n')
+		if ret[0] == 0:
+			self.log('Set ebl_mode to ' + str(ebl_mode))
+		return ret[0]
+
+	def set_host_delay_factor(self, delay_factor):
+		self.log('\nSet delay factor in host', Fore.GREEN)
+		ret = self.send_str_cmd('set_cfg host cdf ' + str(delay_factor) + '\n')
+		if ret[0] == 0:
+			self.log('Set bl comm delay factor to ' + str(delay_factor))
+		return ret[0]
+
+	def set_send_size(self, send_size):
+		self.log('\nSet partial page size in host', Fore.GREEN)
+		ret = self.send_str_cmd('set_partial_size ' + str(send_size) + '\n')
+		if ret[0] == 0:
+			self.log('Set set_partial_size factor to ' + str(send_size))
+		return ret[0]
+
+	def disable_echo(self):
+		while True:
+			ret = self.send_str_cmd('silent_mode 1\n')
+			if ret[0] == 0:
+				self.log('In silent mode. ret: ' + str(ret[0]))
+				break
+			elif ret[0] == -1:
+				break
+			else:
+				self.log("Failed... ret: " + str(ret[0]) + " RETRY...")
+		return ret[0]
+
+	######### Protocol #########
+	def parse_response(self, cmd):
+		start = time.time()
+		try:
+			return self.reader.read_response()
+		finally:
+			self.profile.record('wait', start, port=self.ser.port)
+
+	def write(self, data):
+		start = time.time()
+		self.ser.write(data)
+		self.profile.record('write', start, len(data), port=self.ser.port)
+
+	def send_str_cmd(self, cmd):
+		# commands sent outside a named phase are profiled under their own name
+		if self.profile.current()[0] is None:
+			with self.phase(cmd.split()[0]):
+				return self.exchange(cmd)
+		return self.exchange(cmd)
+
+	def exchange(self, cmd):
+		self.write(cmd.encode())
+		return self.parse_response(cmd.encode())
+
+	######### Bootloader #########
+	def enter_bootloader_mode(self):
+		ret = self.send_str_cmd('bootldr\n')
+		if ret[0] != 0:
+			self.log('Unable to enter bootloader mode... err: ' + str(ret[0]))
+		return ret[0]
+
+	def get_device_info(self):
+		ret = self.send_str_cmd('get_device_info\n')
+		if ret[0] == 0:
+			for key, value in ret[1].items():
+				self.log(key + ' ' + value)
+			try:
+				self.board = platform_types.get(int(ret[1]['platform_type']), 'unknown')
+			except (KeyError, ValueError):
+				self.board = 'unknown'
+		else:
+			self.log('Device Info err: ' + str(ret[0]))
+		return ret[0]
+
+	def get_flash_page_size(self):
+		self.log('\nGet page size', Fore.GREEN)
+		ret = self.send_str_cmd('page_size\n')
+		if ret[0] == 0:
+			self.page_size = int(ret[1]['value'])
+			self.log('Target page size: ' + str(self.page_size))
+			if self.page_size != 8192:
+				self.log('WARNING: Page size is not 8192. page_size: ' + str(self.page_size))
+		return ret[0]
+
+	def get_usn(self):
+		self.log('\nGet USN', Fore.GREEN)
+		ret = self.send_str_cmd('get_usn\n')
+		if ret[0] == 0:
+			self.usn = ret[1]['value'].strip()
+			self.log('USN = ' + self.usn)
+		return ret[0]
+
+	def load_key(self, key_file):
+		self.check(self.enter_bootloader_mode(), 'Entering bootloader mode failed', 'bootldr')
+		self.log('key file name: ' + key_file)
+		try:
+			key_arg = parse_key_file(key_file)
+		except (IOError, OSError, ValueError) as e:
+			raise BootloaderError('Unable to read key file ' + key_file + ': ' + str(e), 'set_key')
+		try:
+			self.send_key(key_arg)
+		except BootloaderError as e:
+			if e.err != ERR_KEY_EXIST:
+				raise
+			# an image encrypted with another key fails authentication
+			self.log('A key is already loaded, the image must be encrypted with it', Fore.YELLOW)
+
+	def send_key(self, key_arg):
+		ret = self.send_str_cmd('set_key ' + key_arg + '\n')
+		self.check(ret[0], 'Key load FAILED', 'set_key')
+		self.log('Set Key bytes succeed.')
+		self.key_digest = hashlib.sha256(key_arg.encode('ascii')).hexdigest()
+
+	def provision_key(self, manifest, usn=None):
+		"""Loads the key manifest assigns to the attached board and records it.
+
+		usn, if known, saves reading it again. Returns the key file name.
+		"""
+		self.check(self.enter_bootloader_mode(), 'Entering bootloader mode failed', 'bootldr')
+		if usn is None:
+			self.check(self.get_usn(), 'Reading USN failed', 'get_usn')
+			usn = self.usn
+		self.usn = usn
+		entry = manifest.lookup(usn)
+		if entry is None:
+			raise BootloaderError('No key in ' + manifest.file_name + ' for USN ' + usn, 'set_key')
+		key_name, key_arg = entry
+		self.send_key(key_arg)
+		ledger = KeyLedger()
+		if not ledger.record(usn, key_name, self.key_digest):
+			self.log('Unable to save ' + ledger.file_name, Fore.YELLOW)
+		self.log('Key ' + key_name + ' loaded into USN ' + usn, Fore.GREEN)
+		return key_name
+
+	def set_iv(self):
+		self.log('\nSet IV', Fore.GREEN)
+		nonce_hex = "".join("{:02X}".format(c) for c in self.image.header.nonce)
+		self.log('set_iv ' + nonce_hex + '\n')
+		ret = self.send_str_cmd('set_iv ' + nonce_hex + '\n')
+		if ret[0] == 0:
+			self.log('Set IV bytes succeed.')
+		return ret[0]
+
+	def set_auth(self):
+		self.log('\nSet Auth', Fore.GREEN)
+		auth_hex = "".join("{:02X}".format(c) for c in self.image.header.auth)
+		self.log('set_auth ' + auth_hex + '\n')
+		ret = self.send_str_cmd('set_auth ' + auth_hex + '\n')
+		if ret[0] == 0:
+			self.log('Set Auth bytes succeed.')
+		return ret[0]
+
+	def set_num_pages(self, num_pages):
+		self.log('\nSet number of pages to download', Fore.GREEN)
+		ret = self.send_str_cmd('num_pages ' + str(num_pages) + '\n')
+		if ret[0] == 0:
+			self.log('Set page size(' + str(num_pages) + ') successfully.')
+		return ret[0]
+
+	def erase_app(self, num_pages=0):
+		self.log('\nErase App', Fore.GREEN)
+		with self.phase('erase'):
+			ret = self.send_str_cmd('erase\n')
+			if ret[0] == 0:
+				self.log('Erasing App flash succeed.')
+				return wait_until_ready(self.send_str_cmd, erase_timeout(num_pages, self.erase_timeout))
+		return ret[0]
+
+	def enter_flash_mode(self):
+		self.log('\nEnter flashing mode', Fore.GREEN)
+		ret = self.send_str_cmd('flash\n')
+		if ret[0] == 0:
+			self.log('flash command succeed.')
+		else:
+			self.log("FAILED: ret: " + str(ret))
+		return ret[0]
+
+	def enable_image_on_RAM(self, enable):
+		self.log('\nEnable image on RAM: ' + str(enable), Fore.GREEN)
+		ret = self.send_str_cmd('image_on_ram ' + str(int(enable == True)) + '\n')
+		if ret[0] == 0:
+			self.log('In image_on_ram Mode.')
+		else:
+			self.log("FAILED: ret: " + str(ret))
+		return ret[0]
+
+	def arm_download(self, num_pages):
+		"""Sends the page count, IV, auth and partial size of the image.
+		Returns None on success, else the BootloaderError of the failed step."""
+		err = self.set_num_pages(num_pages)
+		if err != 0:
+			return step_error('Setting page count (' + str(num_pages) + ') failed', 'num_pages', err)
+
+		err = self.set_iv()
+		if err != 0:
+			return step_error('Setting IV bytes failed', 'set_iv', err)
+
+		err = self.set_auth()
+		if err != 0:
+			return step_error('Setting Auth bytes failed', 'set_auth', err)
+
+		if self.send_size is not None:
+			err = self.set_send_size(self.send_size)
+			if err != 0:
+				return step_error('Setting send size for partial page failed', 'set_partial_size', err)
+		return None
+
+	def send_page(self, page_bin):
+		if not isinstance(page_bin, (bytes, bytearray, memoryview)):
+			page_bin = bytearray(page_bin)
+		step = self.send_size
+		if step is None or step >= len(page_bin):
+			self.write(page_bin)
+			return
+		for i in range(0, len(page_bin), step):
+			self.write(page_bin[i: i + step])
+
+	def download_page(self, page_num):
+		self.send_page(self.image.page[page_num])
+		ret = self.parse_response("NA")
+		return ret[0]
+
+	def download_pages(self, num_pages, label):
+		# Up to self.window pages are sent ahead of their ack, so the link
+		# keeps busy while the host is still flashing the previous page.
+		self.failed_page = None
+		pages = self.image.iter_pages()
+		sent = 0
+		self.report(label, 0, num_pages, 0)
+		for i in range(0, num_pages):
+			while sent < num_pages and sent - i < self.window:
+				with self.phase('page_write', sent):
+					self.send_page(next(pages))
+				sent = sent + 1
+			with self.phase('page_ack', i):
+				ret = self.parse_response("NA")
+			if ret[0] != 0:
+				self.log(label + ' page ' + str(i + 1) + '/' + str(num_pages) + ' FAILED. err: ' + str(ret[0]), Fore.RED)
+				self.failed_page = i + 1
+				# acks of the pages sent ahead are still on their way
+				self.drain_link()
+				# no answer means the link lost bytes, the rest of the session
+				# runs slower; an err= code came over a working link
+				if ret[0] == -1 and self.link_fallback:
+					self.fall_back_link()
+				return ret[0]
+			self.report(label, i + 1, num_pages, (i + 1) * PAGE_LENGTH)
+		return 0
+
+	def program_image(self, num_pages, ledger):
+		"""Arms the bootloader, erases and flashes all pages. Returns None on
+		success, else the BootloaderError of the failed step."""
+		failure = self.arm_download(num_pages)
+		if failure is not None:
+			return failure
+
+		# the old image is gone once erasing starts, even if flashing fails later
+		if ledger is not None and ledger.get(self.usn):
+			ledger.update(self.usn, image=None)
+
+		err = self.erase_app(num_pages)
+		if err != 0:
+			return step_error('Erasing app memory failed', 'erase', err)
+
+		err = self.enter_flash_mode()
+		if err != 0:
+			return step_error('Entering flash mode failed', 'flash', err)
+
+		with self.phase('download'):
+			err = self.download_pages(num_pages, "Flashing")
+		if err != 0:
+			return step_error('Page ' + str(self.failed_page) + '/' + str(num_pages) + ' failed',
+								'flash', err, self.failed_page)
+		return None
+
+	def flash(self, reset=False):
+		"""Single target download of the image, then leaves the bootloader.
+
+		Returns True once the image is flashed, False when skip_same finds
+		it already on the device.
+		"""
+		self.log('\nDownloading msbl file')
+		self.check(self.enter_bootloader_mode(), 'Entering bootloader mode failed', 'bootldr')
+		self.check(self.enable_image_on_RAM(False), 'Unable to disable image_on_RAM', 'image_on_ram')
+		if self.get_device_info() != 0:
+			self.log('Reading device info failed')
+		self.check(self.get_flash_page_size(), 'Reading flash page size failed', 'page_size')
+		self.check(self.get_usn(), 'Reading USN failed', 'get_usn')
+
+		image = self.wait_for_image()
+		num_pages = image.header.numPages
+		# the ledger is only kept for skip_same, other runs leave it alone
+		ledger = FlashLedger() if self.skip_same else None
+		skip = False
+		if ledger is not None and not self.force:
+			with self.phase('ledger'):
+				skip = ledger.matches(self.usn, image.digest(), self.key_digest)
+		if skip:
+			self.log('Device ' + self.usn + ' already holds this image, skipping download', Fore.GREEN)
+			self.leave_bootloader(reset)
+			return False
+
+		# A failed page cannot be resent on its own: pages must follow the
+		# erase in order and an encrypted image is authenticated as a whole,
+		# so a retry starts over from num_pages with the prepared image.
+		failure = self.run_with_retries(lambda: self.program_image(num_pages, ledger), self.usn)
+		if failure is not None:
+			raise failure
+
+		self.log('Flashing MSBL file succeed...')
+		if ledger is not None and not ledger.record(self.usn, image.digest(), self.key_digest,
+					image.file_name):
+			self.log('Unable to save ' + ledger.file_name, Fore.YELLOW)
+		self.leave_bootloader(reset)
+		return True
+
+	def scratch_transfer(self, num_pages, ledger):
+		"""One erase and download of the image for tune, None on success,
+		else the BootloaderError of the failed step."""
+		err = self.enter_bootloader_mode()
+		if err != 0:
+			return step_error('Entering bootloader mode failed', 'bootldr', err)
+		err = self.enable_image_on_RAM(False)
+		if err != 0:
+			return step_error('Unable to disable image_on_RAM', 'image_on_ram', err)
+		if self.usn is None:
+			if self.get_device_info() != 0:
+				self.log('Reading device info failed')
+			err = self.get_usn()
+			if err != 0:
+				return step_error('Reading USN failed', 'get_usn', err)
+		return self.program_image(num_pages, ledger)
+
+	def tune_trial(self, ebl_mode, setting, passes, pages=TUNE_PAGES):
+		"""Flashes the first pages of the image (all with None) passes times
+		with setting.
+
+		Returns the throughput of the fastest pass in bytes per second, 0 if
+		none passed, and the fraction of passes that failed.
+		"""
+		self.log('\nTuning: ' + describe_setting(setting), Fore.GREEN)
+		num_pages = self.wait_for_image().header.numPages
+		cut_short = pages is not None and pages < num_pages
+		if cut_short:
+			num_pages = pages
+		ledger = FlashLedger() if self.skip_same else None
+		self.send_size = setting['send_size']
+		try:
+			self.set_host_mcu(ebl_mode, setting['delay_factor'], setting['comm_interface'])
+		except BootloaderError as e:
+			self.log('Tuning: ' + str(e), Fore.RED)
+			return 0.0, 1.0
+		best = None
+		failures = 0
+		for _ in range(passes):
+			start = time.time()
+			with self.phase('tune'):
+				failure = self.scratch_transfer(num_pages, ledger)
+			if cut_short and failure is not None and failure.page == num_pages and failure.err != -1:
+				# the host may check the whole image on its last page and refuse
+				# one cut short, the link carried every page all the same
+				failure = None
+			if failure is None:
+				seconds = time.time() - start
+				best = seconds if best is None else min(best, seconds)
+				continue
+			self.log('Tuning: ' + str(failure), Fore.RED)
+			failures = failures + 1
+			if not self.resync(self.usn):
+				# nothing more to learn from this setting
+				failures = passes
+				break
+		throughput = num_pages * PAGE_LENGTH / best if best else 0.0
+		return throughput, failures / float(passes)
+
+	def tune(self, ebl_mode, passes=2, start=None, pages=TUNE_PAGES):
+		"""Sweeps interface, delay factor and send size with the image.
+
+		One setting is varied at a time, starting from start (TUNE_START by
+		default), and the candidate with the fewest failures that flashed
+		fastest is kept for the next; a later candidate has to be TUNE_MARGIN
+		faster than an earlier one. Every candidate erases and flashes the
+		first pages of the image (all of it with None) passes times, so the
+		device holds no valid application afterwards. Returns the best setting with its throughput and
+		error_rate, and the list of all trials as (setting, throughput,
+		error_rate). Raises BootloaderError if no candidate worked.
+		"""
+		best = dict(start if start is not None else TUNE_START)
+		trials = {}
+		order = []
+		self.link_fallback = False
+		try:
+			for name, values in (('comm_interface', TUNE_INTERFACES),
+									('delay_factor', TUNE_DELAY_FACTORS),
+									('send_size', TUNE_SEND_SIZES)):
+				chosen = None
+				for value in [best[name]] + [v for v in values if v != best[name]]:
+					setting = dict(best)
+					setting[name] = value
+					key = tuple(sorted(setting.items()))
+					if key not in trials:
+						trials[key] = self.tune_trial(ebl_mode, setting, passes, pages)
+						order.append(key)
+					throughput, error_rate = trials[key]
+					if chosen is None or error_rate < chosen[1] or \
+							(error_rate == chosen[1] and throughput > chosen[0] * TUNE_MARGIN):
+						chosen = (throughput, error_rate, value)
+				if chosen[1] >= 1.0:
+					raise BootloaderError('No ' + name + ' flashes the image', 'tune')
+				best[name] = chosen[2]
+		finally:
+			self.link_fallback = True
+		throughput, error_rate = trials[tuple(sorted(best.items()))]
+		best['throughput'] = throughput
+		best['error_rate'] = error_rate
+		return best, [(dict(key), trials[key][0], trials[key][1]) for key in order]
+
+	def load_to_RAM(self):
+		"""Downloads the image to the host's RAM for flash_from_RAM."""
+		self.log('\nDownloading msbl file')
+		self.check(self.enable_image_on_RAM(True), 'Unable to enable image_on_RAM', 'image_on_ram')
+		wait_until_ready(self.send_str_cmd, 0.2, HOST_READY_CMD)
+		num_pages = self.wait_for_image().header.numPages
+
+		failure = self.arm_download(num_pages)
+		if failure is not None:
+			raise failure
+		self.check(self.enter_flash_mode(), 'Entering flash mode failed', 'flash')
+
+		start = time.time()
+		with self.phase('download_to_ram'):
+			err = self.download_pages(num_pages, "Downloading to Host RAM")
+		self.check(err, 'Downloading image to Host RAM failed', 'flash')
+		self.log("Downloading an image to host RAM takes " + str(time.time() - start) + " sec...")
+
+	def flash_image_on_RAM(self, num_pages):
+		self.log('\n' + str(datetime.time(datetime.now())) + ' - Flashing Firmware on RAM', Fore.GREEN)
+		self.failed_page = None
+		ret = self.send_str_cmd('image_flash\n')
+		if ret[0] != 0:
+			self.log("FAILED: ret: " + str(ret))
+			return ret[0]
+
+		err = 0
+		self.report('Flashing', 0, num_pages, 0)
+		for i in range(0, num_pages):
+			# the progress line of the page is skipped by the reader
+			ret = self.parse_response("NA")
+			if ret[0] == 0:
+				if err == 0:
+					self.report('Flashing', i + 1, num_pages, (i + 1) * PAGE_LENGTH)
+				continue
+			self.log('Flashing page ' + str(i + 1) + '/' + str(num_pages) + ' FAILED. err: ' + str(ret[0]), Fore.RED)
+			if err == 0:
+				err = ret[0]
+				self.failed_page = i + 1
+			if ret[0] == -1:
+				break
+
+		if err == 0:
+			self.log('flash command succeed.')
+		return err
+
+	def program_from_RAM(self, num_pages):
+		err = self.flash_image_on_RAM(num_pages)
+		if err == 0:
+			return None
+		if self.failed_page is None:
+			return step_error('image_flash failed', 'image_flash', err)
+		return step_error('Page ' + str(self.failed_page) + '/' + str(num_pages) + ' failed',
+							'image_flash', err, self.failed_page)
+
+	def flash_from_RAM(self, usn=None):
+		"""Flashes the image held in host RAM to the attached board.
+
+		The host keeps the image, so a failed page is retried by flashing it
+		all again. usn, if known, makes a recovery check for the same board.
+		"""
+		num_pages = self.image.header.numPages
+		failure = self.run_with_retries(lambda: self.program_from_RAM(num_pages), usn)
+		if failure is not None:
+			raise failure
+
+	def probe_target(self):
+		"""Returns the USN of the board whose bootloader answers, None if no board answers.
+		Only get_usn is sent, a board running its application is left alone."""
+		ret = self.send_str_cmd('get_usn\n')
+		if ret[0] != 0:
+			return None
+		return ret[1]['value'].strip()
+
+	def wait_for_new_target(self, last_usn, poll_interval):
+		# Only a USN other than the one just flashed is a new board. A quiet
+		# host does not tell a removed board from one that is resetting or
+		# running its application, so the same board is never taken twice in
+		# a row. Only a new board is put in bootloader mode, so polling never
+		# pulls the board just flashed back out of its application.
+		while not self.quit_flag:
+			usn = self.probe_target()
+			if usn is not None and usn != last_usn and self.enter_bootloader_mode() == 0:
+				return usn
+			time.sleep(poll_interval)
+		return None
+
+	def restart_device(self):
+		self.log('\nRestart device', Fore.GREEN)
+		with self.phase('reset'):
+			ret = self.send_str_cmd('reset\n')
+		if ret[0] == 0:
+			self.log('Restarting device. ret: ' + str(ret[0]))
+		return ret[0]
+
+	def exit_from_bootloader(self, num_pages):
+		self.log('\nJump to main application', Fore.GREEN)
+		with self.phase('exit'):
+			# the bootloader may still be checking the image after the last page
+			wait_until_ready(self.send_str_cmd, max(0.5, 0.03*num_pages))
+			ret = self.send_str_cmd('exit\n')
+		if ret[0] == 0:
+			self.log('Jumping to main application. ret: ' + str(ret[0]))
+		return ret[0]
+
+	def leave_bootloader(self, reset=False):
+		"""Resets the target or jumps to the application it holds."""
+		if reset:
+			self.log("Resetting target...")
+			self.check(self.restart_device(), 'Resetting target failed', 'reset')
+		else:
+			num_pages = self.image.header.numPages if self.image is not None else 0
+			self.check(self.exit_from_bootloader(num_pages), 'FAILED to jump application', 'exit')
+
+	def quit(self):
+		self.quit_flag = True
+		self.close()
+
+	def close(self):
+		self.log("Closing")
+		self.ser.close()
+
+
+######### Bootloader Configuration #########
+bl_exit_mode = { 0 : 'Jump immediately',
+				1 : 'Wait for programmable delay',
+				2 : 'remain in bootloader until receive exit command'}
+
+bl_gpio_polarities = {  0 : 'active low',
+						1 : 'active high'}
+
+bl_entry_check = {	0 : 'Do not check EBL pin',
+					1 : 'Check EBL pin'}
+
+bl_config_en_dis = { 0 : 'disabled',
+					 1 : 'enabled'}
+
+bl_config_i2c_addr = {  0 : '0x58',
+						1 : '0x5A',
+						2 : '0x5C',
+						3 : '0xAA'}
+
+# [BootConfig] key, set_cfg bl command, get_cfg bl key
+bl_config_commands = [	('enter_bl_check', 'enter_mode', 'enter_bl_check'),
+						('ebl_pin', 'enter_pin 0', 'ebl_pin'),
+						('ebl_pol', 'enter_pol', 'ebl_polarity'),
+						('valid_mark_check', 'valid', 'valid_mark_check'),
+						('uart_enable', 'uart', 'uart_enable'),
+						('i2c_enable', 'i2c', 'i2c_enable'),
+						('spi_enable', 'spi', 'spi_enable'),
+						('i2c_addr', 'addr_i2c', 'i2c_addr'),
+						('crc_check', 'crc', 'crc_check'),
+						('swd_lock', 'swd_lock', 'swd_lock'),
+						('ebl_timeout', 'exit_to', 'ebl_timeout'),
+						('exit_bl_mode', 'exit_mode', 'exit_bl_mode')]
+
+ERR_TRY_AGAIN = 0xFE
+
+# bootloaders before this version report i2c_addr as an index of bl_config_i2c_addr
+I2C_ADDR_INDEX_BEFORE = (3, 4, 2)
+
+def read_profile(config_file):
+	"""Returns the [BootConfig] settings of a config file as {key: int}."""
+	config = ConfigParser.RawConfigParser()
+	if not config.read(config_file):
+		raise IOError('Unable to read ' + config_file)
+	return dict((key, config.getint('BootConfig', key)) for key, _, _ in bl_config_commands)
+
+def version_tuple(text):
+	"""A version string such as '3.4.2' as a tuple of ints, for comparing."""
+	return tuple(int(part) for part in re.findall(r'\d+', str(text)))
+
+def i2c_addr_is_index(bl_version):
+	return bl_version is not None and version_tuple(bl_version) < I2C_ADDR_INDEX_BEFORE
+
+def reported_i2c_addr(value, bl_version):
+	"""The I2C address in a get_cfg bl reply as a number."""
+	if i2c_addr_is_index(bl_version):
+		address = bl_config_i2c_addr.get(int(value))
+		if address is not None:
+			return int(address, 16)
+	return int(value)
+
+def normalize_config(bl_config, bl_version):
+	"""A get_cfg bl reply as [BootConfig] settings, {key: int}."""
+	settings = {}
+	for key, _, cfg_key in bl_config_commands:
+		if key == 'i2c_addr':
+			settings[key] = reported_i2c_addr(bl_config[cfg_key], bl_version)
+		else:
+			settings[key] = int(bl_config[cfg_key])
+	return settings
+
+def config_differences(profile, settings, bl_version=None):
+	"""Returns [(key, expected, actual)] of the profile settings a board does not
+	have. settings come from normalize_config, so i2c_addr is compared as an
+	address: for bootloaders before 3.4.2 the profile holds an index as well."""
+	expected = dict(profile)
+	if 'i2c_addr' in expected:
+		expected['i2c_addr'] = reported_i2c_addr(expected['i2c_addr'], bl_version)
+	return [(key, expected[key], settings.get(key)) for key, _, _ in bl_config_commands
+			if key in expected and settings.get(key) != expected[key]]
+
+class MaximBootloaderConfigurator(object):
+	"""Reads and writes the bootloader configuration through the host.
+
+	Failed steps raise BootloaderError, messages go to output(message, color)
+	when an output callback is given.
+	"""
+	def __init__(self, port, baudrates=None, batch=False, output=None):
+		self.output = output
+		try:
+			self.ser = create_port(port)
+		except ValueError as e:
+			raise PortError(str(e))
+		self.ser.baudrate = 115200
+		self.ser.timeout = 300
+		self.reader = ResponseReader(self.ser)
+		self.baudrates = baudrates
+		self.batch = batch
+		self.bl_config = None
+		try:
+			self.ser.open()	 # open the serial port
+		except (OSError, serial.SerialException) as e:
+			raise PortError('Cannot open serial port ' + port + ': ' + str(e))
+		self.log(self.ser.name + ' is open...')
+
+		self.negotiate_link()
+		self.quit_flag = False
+
+	def log(self, message, color=''):
+		if self.output is not None:
+			self.output(message, color)
+
+	def check(self, err, message, step):
+		if err != 0:
+			raise step_error(message, step, err)
+
+	def negotiate_link(self):
+		if is_network(self.ser):
+			self.log('Link speed is set by the bridge at ' + self.ser.port)
+			return None
+		rate = negotiate_baudrate(self.ser, self.ser.port, self.baudrates, output=self.output)
+		self.reader.clear()
+		if rate is None:
+			self.log('Host did not answer the baud rate probe, using ' + str(self.ser.baudrate), Fore.YELLOW)
+		else:
+			self.log('Link speed: ' + str(rate) + ' baud')
+		return rate
+
+	def fall_back_link(self):
+		if is_network(self.ser):
+			return False
+		rate = fall_back_baudrate(self.ser, self.baudrates)
+		self.reader.clear()
+		if rate is None:
+			self.log('No slower baud rate left to fall back to')
+			return False
+		self.log('Link errors, falling back to ' + str(rate) + ' baud', Fore.YELLOW)
+		return True
+
+	def set_host_mcu(self, ebl_mode, delay_factor, comm_interface):
+		if not EBL_MODE.USE_TIMEOUT <= ebl_mode <= EBL_MODE.USE_GPIO:
+			raise ValueError('Invalid ebl_mode: ' + str(ebl_mode))
+
+		if comm_interface is not None:
+			self.check(self.set_host_comm_interface(comm_interface),
+						'Unable to change communication medium', 'set_cfg comm')
+
+		err = self.disable_echo()
+		if err != 0 and self.fall_back_link():
+			err = self.disable_echo()
+		self.check(err, 'Unable to disable echo mode. Communication failed', 'silent_mode')
+
+		self.check(self.set_host_ebl_mode(ebl_mode), 'Unable to set EBL mode in host', 'set_cfg host ebl')
+		self.check(self.set_host_delay_factor(delay_factor),
+					'Unable to set delay factor mode in host', 'set_cfg host cdf')
+
+
+	######### Bootloader Configure #########
+	def bootloader_configure(self, reset, config_file):
+		self.log('\nConfiguring bootloader')
+		config = ConfigParser.RawConfigParser()
+		if config_file!= None:
+			config.read(config_file)
+
+		self.check(self.enter_bootloader_mode(), 'Entering bootloader mode failed', 'bootldr')
+
+		self.bl_version = self.get_bl_version()
+		if self.bl_version is None:
+			self.log('Unable to read bootloader version')
+
+		if config_file is None:
+			self.check(self.get_config_bl(), 'Reading BL config failed', 'get_cfg bl')
+			self.exit_from_bootloader(0)
+			return
+
+		# Read the current config once and write only the settings that
+		# differ, so an already configured board costs no set_cfg and no
+		# save (a flash write of the config).
+		self.check(self.send_get_cfg_bl(), 'Reading BL config failed', 'get_cfg bl')
+		current = normalize_config(self.bl_config, self.bl_version)
+		profile = dict((key, config.getint('BootConfig', key)) for key, _, _ in bl_config_commands)
+		changed = dict((key, profile[key]) for key, _, _ in config_differences(profile, current, self.bl_version))
+		if not changed:
+			self.log('Bootloader config already matches ' + config_file, Fore.GREEN)
+			self.exit_from_bootloader(0)
+			return
+		self.log(str(len(changed)) + ' of ' + str(len(profile)) + ' settings differ')
+
+		if self.batch:
+			plan = [step for step in self.build_config_plan(config) if step[0] in changed]
+			self.check(self.apply_config_plan(plan), 'Bootloader configuration failed', 'set_cfg bl')
+
+		else:
+			if 'enter_bl_check' in changed:
+				var = changed['enter_bl_check']
+				self.check(self.set_config_ebl_check(str(var)), 'Enter BL check configuration failed', 'set_cfg bl enter_mode')
+
+			if 'ebl_pin' in changed:
+				var = changed['ebl_pin']
+				self.check(self.set_config_ebl_pin(str(var)), 'EBL Pin configuration failed', 'set_cfg bl enter_pin')
+
+			if 'ebl_pol' in changed:
+				var = changed['ebl_pol']
+				self.check(self.set_config_ebl_polarity(str(var)), 'EBL Pin Polarity configuration failed', 'set_cfg bl enter_pol')
+
+			if 'valid_mark_check' in changed:
+				var = changed['valid_mark_check']
+				self.check(self.set_config_valid_check(str(var)), 'Valid Mark Check configuration failed', 'set_cfg bl valid')
+
+			if 'uart_enable' in changed:
+				var = changed['uart_enable']
+				self.check(self.set_config_interface('uart', str(var)), 'UART interface configuration failed', 'set_cfg bl uart')
+
+			if 'i2c_enable' in changed:
+				var = changed['i2c_enable']
+				self.check(self.set_config_interface('i2c', str(var)), 'I2C interface configuration failed', 'set_cfg bl i2c')
+
+			if 'spi_enable' in changed:
+				var = changed['spi_enable']
+				self.check(self.set_config_interface('spi', str(var)), 'SPI interface configuration failed', 'set_cfg bl spi')
+
+			if 'i2c_addr' in changed:
+				var = changed['i2c_addr']
+				self.check(self.set_config_i2c_addr(str(var)), 'I2C Slave Addr configuration failed', 'set_cfg bl addr_i2c')
+
+			if 'crc_check' in changed:
+				var = changed['crc_check']
+				self.check(self.set_config_crc_check(str(var)), 'CRC Check configuration failed', 'set_cfg bl crc')
+
+			if 'swd_lock' in changed:
+				var = changed['swd_lock']
+				self.check(self.set_config_swd_lock(str(var)), 'SWD Lock configuration failed', 'set_cfg bl swd_lock')
+
+			if 'ebl_timeout' in changed:
+				var = changed['ebl_timeout']
+				self.check(self.set_config_bl_timeout(str(var)), 'BL Timeout configuration failed', 'set_cfg bl exit_to')
+
+			if 'exit_bl_mode' in changed:
+				var = changed['exit_bl_mode']
+				self.check(self.set_exit_bl_to_mode(str(var)), 'Exit BL Timeout Mode configuration failed', 'set_cfg bl exit_mode')
+
+			self.check(self.save_bl_config(), 'Bootloader Config save failed', 'set_cfg bl save')
+
+		self.check(self.get_config_bl(), 'Reading BL config failed', 'get_cfg bl')
+
+		if self.batch:
+			if self.verify_config_plan(plan):
+				raise BootloaderError('Bootloader configuration does not match ' + config_file, 'get_cfg bl')
+
+		self.exit_from_bootloader(0)
+
+	def build_config_plan(self, config):
+		plan = []
+		for key, command, cfg_key in bl_config_commands:
+			value = config.getint('BootConfig', key)
+			plan.append((key, value, 'set_cfg bl ' + command + ' ' + str(value) + '\n'))
+		return plan
+
+	def apply_config_plan(self, plan):
+		# All set_cfg commands go out back to back and their replies are
+		# matched in order; only those the bootloader was too busy for are
+		# sent again one by one.
+		self.ser.write(''.join(cmd for _, _, cmd in plan).encode())
+		retry = []
+		for key, value, cmd in plan:
+			ret = self.parse_response(cmd)
+			if ret[0] == ERR_TRY_AGAIN:
+				retry.append((key, value, cmd))
+			elif ret[0] != 0:
+				self.log('\t' + key + ' configuration failed. err: ' + str(ret[0]), Fore.RED)
+				return ret[0]
+			else:
+				self.log('\t' + key + ': ' + str(value), Fore.GREEN)
+
+		for key, value, cmd in retry:
+			self.wait_until_ready()
+			ret = self.send_str_cmd(cmd)
+			if ret[0] != 0:
+				self.log('\t' + key + ' configuration failed. err: ' + str(ret[0]), Fore.RED)
+				return ret[0]
+			self.log('\t' + key + ': ' + str(value), Fore.GREEN)
+
+		return self.save_bl_config()
+
+	def verify_config_plan(self, plan):
+		mismatch = 0
+		cfg_keys = dict((key, cfg_key) for key, _, cfg_key in bl_config_commands)
+		for key, value, cmd in plan:
+			cfg_key = cfg_keys[key]
+			if int(self.bl_config[cfg_key]) != value:
+				self.log('\t' + key + ' is ' + str(self.bl_config[cfg_key]).strip()
+						+ ', expected ' + str(value), Fore.RED)
+				mismatch = mismatch + 1
+		return mismatch
+
+
+	def audit(self):
+		"""Reads the device info and bootloader configuration without changing
+		them, then lets the board run its application again. Returns
+		(device_info, bl_config), both as received."""
+		self.check(self.enter_bootloader_mode(), 'Entering bootloader mode failed', 'bootldr')
+		ret = self.send_str_cmd('get_device_info\n')
+		self.check(ret[0], 'Reading device info failed', 'get_device_info')
+		device_info = dict((key, value) for key, value in ret[1].items() if key != 'err')
+		try:
+			device_info['platform'] = platform_types[int(device_info['platform_type'])]
+		except (KeyError, ValueError):
+			pass
+		self.bl_version = device_info.get('hub_firm_ver')
+		self.check(self.send_get_cfg_bl(), 'Reading BL config failed', 'get_cfg bl')
+		self.exit_from_bootloader(0)
+		return device_info, dict((key, value) for key, value in self.bl_config.items() if key != 'err')
+
+	def set_host_comm_interface(self, comm):
+		self.log('\nBootloader communication interface as ' + comm, Fore.GREEN)
+		ret = self.send_str_cmd('set_cfg comm ' + str(comm) + '\n')
+		if ret[0] == 0:
+			self.log('Set comm interface to ' + str(comm))
+		wait_until_ready(self.send_str_cmd, 0.6, HOST_READY_CMD)
+		return ret[0]
+
+	def wait_until_ready(self):
+		# set_cfg and save replies may come before the bootloader is done
+		return wait_until_ready(self.send_str_cmd, 0.6)
+
+	def set_config_ebl_check(self, ebl):
+		ret = self.send_str_cmd('set_cfg bl enter_mode ' + str(ebl) + '\n')
+		if ret[0] == 0:
+			self.log('\tenter_bl_check ' + bl_config_en_dis[int(ebl)], Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_config_ebl_polarity(self, pol):
+		ret = self.send_str_cmd('set_cfg bl enter_pol ' + str(pol) + '\n')
+		if ret[0] == 0:
+			self.log('\tebl_polarity is ' + bl_gpio_polarities[int(pol)], Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_config_ebl_pin(self, pin):
+		ret = self.send_str_cmd('set_cfg bl enter_pin ' + '0 ' + str(pin) + '\n')
+		if ret[0] == 0:
+			self.log('\tebl_pin ' + pin, Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_config_valid_check(self, validMark):
+		ret = self.send_str_cmd('set_cfg bl valid ' + str(validMark) + '\n')
+		if ret[0] == 0:
+			if(validMark):
+				self.log('\tvalid_mark_check ' + bl_config_en_dis[int(validMark)], Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_config_interface(self, interface, comm):
+
+		ret = self.send_str_cmd('set_cfg bl ' + interface + ' ' + str(comm) + '\n')
+		if ret[0] == 0:
+			self.log('\t' + interface.lower() + '_enable: ' + str(comm), Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_config_i2c_addr(self, i2c_addr):
+		ret = self.send_str_cmd('set_cfg bl addr_i2c ' + str(i2c_addr) + '\n')
+		if ret[0] == 0:
+			if i2c_addr_is_index(self.bl_version):
+				i2c_addr = bl_config_i2c_addr.get(int(i2c_addr), i2c_addr)
+			self.log('\ti2c_addr: ' + str(i2c_addr), Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_config_crc_check(self, crc):
+		ret = self.send_str_cmd('set_cfg bl crc ' + str(crc) + '\n')
+		if ret[0] == 0:
+			self.log('\tcrc_check ' + bl_config_en_dis[int(crc)], Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_config_swd_lock(self, lock_mode):
+		ret = self.send_str_cmd('set_cfg bl swd_lock ' + str(lock_mode) + '\n')
+		if ret[0] == 0:
+			self.log('\tswd_lock ' + bl_config_en_dis[int(lock_mode)], Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_exit_bl_to_mode(self, mode):
+		ret = self.send_str_cmd('set_cfg bl exit_mode ' + str(mode) + '\n')
+		if ret[0] == 0:
+			self.log('\texit_bl_mode: ' + bl_exit_mode[int(mode)], Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def set_config_bl_timeout(self, timeout):
+		ret = self.send_str_cmd('set_cfg bl exit_to ' + str(timeout) + '\n')
+		if ret[0] == 0:
+			self.log('\tebl_timeout: ' + timeout, Fore.GREEN)
+		self.wait_until_ready()
+		return ret[0]
+
+	def save_bl_config(self):
+		ret = self.send_str_cmd('set_cfg bl save ' + '\n')
+		if ret[0] == 0:
+			self.log('Bootloader Config saved')
+		self.wait_until_ready()
+		return ret[0]
+
+	def get_bl_version(self):
+		ret = self.send_str_cmd('get_device_info\n')
+		version = None
+		if ret[0] == 0:
+			version = str(ret[1]['hub_firm_ver'])
+		return version
+
+	def send_get_cfg_bl(self):
+		ret = self.send_str_cmd('get_cfg bl\n')
+		if ret[0] == 0:
+			self.bl_config = ret[1]
+		return ret[0]
+
+	def get_config_bl(self):
+		ret = self.send_str_cmd('get_cfg bl\n')
+		if ret[0] == 0:
+			self.bl_config = ret[1]
+			i2c_addr = int(ret[1]['i2c_addr'])
+			if i2c_addr_is_index(self.bl_version):
+				i2c_addr = bl_config_i2c_addr[i2c_addr]
+			self.log('\tBL config received ', Fore.GREEN)
+			self.log('\tenter_bl_check ' + bl_config_en_dis[int(ret[1]['enter_bl_check'])], Fore.GREEN)
+			self.log('\tebl_pin: ' + str(ret[1]['ebl_pin']), Fore.GREEN)
+			self.log('\tebl_polarity is ' + bl_gpio_polarities[int(ret[1]['ebl_polarity'])], Fore.GREEN)
+			self.log('\tvalid_mark_check: ' + bl_config_en_dis[int(ret[1]['valid_mark_check'])], Fore.GREEN)
+			self.log('\tuart_enable: ' + str(ret[1]['uart_enable']), Fore.GREEN)
+			self.log('\ti2c_enable: ' + str(ret[1]['i2c_enable']), Fore.GREEN)
+			self.log('\tspi_enable: ' + str(ret[1]['spi_enable']), Fore.GREEN)
+			self.log('\ti2c_addr: ' + str(i2c_addr), Fore.GREEN)
+			self.log('\tcrc_check ' + bl_config_en_dis[int(ret[1]['crc_check'])], Fore.GREEN)
+			self.log('\tswd_lock ' + bl_config_en_dis[int(ret[1]['swd_lock'])], Fore.GREEN)
+			self.log('\tebl_timeout: ' + str(ret[1]['ebl_timeout']), Fore.GREEN)
+			self.log('\texit_bl_mode: ' + bl_exit_mode[int(ret[1]['exit_bl_mode'])], Fore.GREEN)
+		return ret[0]
+
+	def set_host_ebl_mode(self, ebl_mode):
+		self.log('\nSet timeout mode to enter bootloader', Fore.GREEN)
+		ret = self.send_str_cmd('set_cfg host ebl ' + str(ebl_mode) + '\n')
+		self.log('Command: set_cfg host ebl ' + str(ebl_mode) + '\n')
+		if ret[0] == 0:
+			self.log('Set ebl_mode to ' + str(ebl_mode))
+		return ret[0]
+
+	def set_host_delay_factor(self, delay_factor):
+		self.log('\nSet delay factor in host', Fore.GREEN)
+		ret = self.send_str_cmd('set_cfg host cdf ' + str(delay_factor) + '\n')
+		if ret[0] == 0:
+			self.log('Set bl comm delay factor to ' + str(delay_factor))
+		return ret[0]
+
+	def disable_echo(self):
+		while True:
+			ret = self.send_str_cmd('silent_mode 1\n')
+			if ret[0] == 0:
+				self.log('In silent mode. ret: ' + str(ret[0]))
+				break
+			elif ret[0] == -1:
+				break
+			else:
+				self.log("Failed... ret: " + str(ret[0]) + " RETRY...")
+		return ret[0]
+
+	def parse_response(self, cmd):
+		return self.reader.read_response()
+
+	def send_str_cmd(self, cmd):
+		self.ser.write(cmd.encode())
+		return self.parse_response(cmd.encode())
+
+	def enter_bootloader_mode(self):
+		ret = self.send_str_cmd('bootldr\n')
+		if ret[0] != 0:
+			self.log('Unable to enter bootloader mode... err: ' + str(ret[0]))
+		return ret[0]
+
+	def get_device_info(self):
+		ret = self.send_str_cmd('get_device_info\n')
+		if ret[0] == 0:
+			for key, value in ret[1].items():
+			    self.log(key + ' ' + value)
+		else:
+			self.log('Device Info err: ' + str(ret[0]))
+		return ret[0]
+
+	def exit_from_bootloader(self, num_pages):
+		if num_pages:
+			wait_until_ready(self.send_str_cmd, 0.03*num_pages)
+		self.log('\nJump to main application', Fore.GREEN)
+		ret = self.send_str_cmd('exit\n')
+		if ret[0] == 0:
+			self.log('Jumping to main application. ret: ' + str(ret[0]))
+		return ret[0]
+
+	def quit(self):
+		self.quit_flag = True
+		self.close()
+
+	def close(self):
+		self.log("Closing")
+		self.ser.close()